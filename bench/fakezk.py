@@ -0,0 +1,443 @@
+"""An in-process stand-in for the zookeeper C binding's python module, good
+enough to drive zkmirror without a real ensemble. Install it with
+
+  sys.modules['zookeeper'] = fakezk
+
+before zkmirror is imported. Every handle shares one in-memory tree. Requests
+are applied as soon as they are made, and each handle's completions and watch
+events are delivered in order on that handle's own thread, as the real
+client's completion thread does.
+
+expire(handle) simulates the server expiring a session, and reset() empties
+the tree between benchmarks.
+"""
+from threading import Thread, RLock
+from Queue import Queue
+import traceback
+import itertools
+import time
+
+_pyset = set
+
+OK                      = 0
+SYSTEMERROR             = -1
+RUNTIMEINCONSISTENCY    = -2
+DATAINCONSISTENCY       = -3
+CONNECTIONLOSS          = -4
+MARSHALLINGERROR        = -5
+UNIMPLEMENTED           = -6
+OPERATIONTIMEOUT        = -7
+BADARGUMENTS            = -8
+INVALIDSTATE            = -9
+APIERROR                = -100
+NONODE                  = -101
+NOAUTH                  = -102
+BADVERSION              = -103
+NOCHILDRENFOREPHEMERALS = -108
+NODEEXISTS              = -110
+NOTEMPTY                = -111
+SESSIONEXPIRED          = -112
+INVALIDCALLBACK         = -113
+INVALIDACL              = -114
+AUTHFAILED              = -115
+CLOSING                 = -116
+NOTHING                 = -117
+SESSIONMOVED            = -118
+
+CONNECTING_STATE      = 1
+ASSOCIATING_STATE     = 2
+CONNECTED_STATE       = 3
+EXPIRED_SESSION_STATE = -112
+AUTH_FAILED_STATE     = -113
+
+CREATED_EVENT     = 1
+DELETED_EVENT     = 2
+CHANGED_EVENT     = 3
+CHILD_EVENT       = 4
+SESSION_EVENT     = -1
+NOTWATCHING_EVENT = -2
+
+PERM_READ   = 1
+PERM_WRITE  = 2
+PERM_CREATE = 4
+PERM_DELETE = 8
+PERM_ADMIN  = 16
+PERM_ALL    = 31
+
+EPHEMERAL = 1
+SEQUENCE  = 2
+
+LOG_LEVEL_ERROR = 1
+LOG_LEVEL_WARN  = 2
+LOG_LEVEL_INFO  = 3
+LOG_LEVEL_DEBUG = 4
+
+class ZooKeeperException(Exception):
+  pass
+
+_EXCEPTIONS = {}
+
+def _exception(name, code):
+  cls = type(name, (ZooKeeperException,), {})
+  _EXCEPTIONS[code] = cls
+  globals()[name] = cls
+
+_exception('SystemErrorException',             SYSTEMERROR)
+_exception('RuntimeInconsistencyException',    RUNTIMEINCONSISTENCY)
+_exception('DataInconsistencyException',       DATAINCONSISTENCY)
+_exception('ConnectionLossException',          CONNECTIONLOSS)
+_exception('MarshallingErrorException',        MARSHALLINGERROR)
+_exception('UnimplementedException',           UNIMPLEMENTED)
+_exception('OperationTimeoutException',        OPERATIONTIMEOUT)
+_exception('BadArgumentsException',            BADARGUMENTS)
+_exception('InvalidStateException',            INVALIDSTATE)
+_exception('ApiErrorException',                APIERROR)
+_exception('NoNodeException',                  NONODE)
+_exception('NoAuthException',                  NOAUTH)
+_exception('BadVersionException',              BADVERSION)
+_exception('NoChildrenForEphemeralsException', NOCHILDRENFOREPHEMERALS)
+_exception('NodeExistsException',              NODEEXISTS)
+_exception('NotEmptyException',                NOTEMPTY)
+_exception('SessionExpiredException',          SESSIONEXPIRED)
+_exception('InvalidCallbackException',         INVALIDCALLBACK)
+_exception('InvalidACLException',              INVALIDACL)
+_exception('AuthFailedException',              AUTHFAILED)
+_exception('ClosingException',                 CLOSING)
+_exception('NothingException',                 NOTHING)
+_exception('SessionMovedException',            SESSIONMOVED)
+
+def zerror(rc):
+  try:
+    return _EXCEPTIONS[rc].__name__[:-len('Exception')]
+  except KeyError:
+    return 'unknown error %d' % rc
+
+def set_debug_level(level):
+  pass
+
+def set_log_stream(stream):
+  pass
+
+class _Znode(object):
+  __slots__ = ('value', 'stat', 'children', 'owner')
+
+  def __init__(self, value, owner, zxid):
+    now = int(time.time() * 1000)
+    self.value    = value
+    self.children = _pyset()
+    self.owner    = owner
+    self.stat     = {
+        'czxid':          zxid,
+        'mzxid':          zxid,
+        'pzxid':          zxid,
+        'ctime':          now,
+        'mtime':          now,
+        'version':        0,
+        'cversion':       0,
+        'aversion':       0,
+        'ephemeralOwner': owner,
+        'dataLength':     len(value or ''),
+        'numChildren':    0,
+        }
+
+class _Server(object):
+  def __init__(self):
+    self.lock = RLock()
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.zxid     = itertools.count(1)
+      self.tree     = {'/': _Znode('', 0, 0)}
+      self.data_w   = {}
+      self.child_w  = {}
+      self.exist_w  = {}
+
+  def fire(self, table, path, event):
+    for (handle, watcher) in table.pop(path, ()):
+      session = _sessions.get(handle)
+      if session is not None:
+        session.deliver(lambda session=session, watcher=watcher:
+            watcher(session.handle, event, CONNECTED_STATE,
+              session.rel(path)))
+
+_server   = _Server()
+_sessions = {}
+_handles  = itertools.count(0)
+
+class _Session(object):
+  def __init__(self, handle, chroot, watcher):
+    self.handle    = handle
+    self.chroot    = chroot
+    self.watcher   = watcher
+    self.alive     = True
+    self.requests  = 0
+    self.completed = 0
+    self.__q       = Queue()
+    self.__thread  = Thread(target=self.__run,
+        name='fakezk-completion-%d' % handle)
+    self.__thread.daemon = True
+    self.__thread.start()
+
+  def deliver(self, fn):
+    self.__q.put(fn)
+
+  def stop(self):
+    self.__q.put(None)
+
+  def __run(self):
+    while True:
+      fn = self.__q.get()
+      if fn is None:
+        return
+      try:
+        fn()
+      except Exception:
+        traceback.print_exc()
+      self.completed += 1
+
+  def abs(self, path):
+    if not self.chroot:
+      return path
+    return (self.chroot + path).rstrip('/') or '/'
+
+  def rel(self, path):
+    if not self.chroot or path is None:
+      return path
+    return path[len(self.chroot):] or '/'
+
+def reset():
+  """Forget every node and watch. Open handles stay usable."""
+  _server.reset()
+
+def expire(handle):
+  """Make the server expire the given session: its watches and ephemeral
+  nodes go away, and its watcher is told EXPIRED_SESSION_STATE.
+  """
+  session = _sessions.get(handle)
+  if session is None:
+    return
+  session.alive = False
+  _drop(handle)
+  if session.watcher is not None:
+    session.deliver(lambda: session.watcher(handle, SESSION_EVENT,
+      EXPIRED_SESSION_STATE, ''))
+
+def counters(handle):
+  """Return (requests sent, completions and events delivered) for handle."""
+  session = _sessions.get(handle)
+  if session is None:
+    return (0, 0)
+  return (session.requests, session.completed)
+
+def init(hosts, watcher=None, timeout=10000, clientid=None):
+  chroot = ''
+  if '/' in hosts:
+    hosts, chroot = hosts.split('/', 1)
+    chroot = '/' + chroot.strip('/')
+  handle  = next(_handles)
+  session = _sessions[handle] = _Session(handle, chroot, watcher)
+  if watcher is not None:
+    session.deliver(lambda: watcher(handle, SESSION_EVENT, CONNECTED_STATE,
+      ''))
+  return handle
+
+def close(handle):
+  session = _sessions.pop(handle, None)
+  if session is None:
+    return OK
+  _drop(handle)
+  session.stop()
+  return OK
+
+def state(handle):
+  session = _sessions.get(handle)
+  if session is None or not session.alive:
+    return EXPIRED_SESSION_STATE
+  return CONNECTED_STATE
+
+def _drop(handle):
+  with _server.lock:
+    for table in (_server.data_w, _server.child_w, _server.exist_w):
+      for path in table:
+        table[path] = _pyset(w for w in table[path] if w[0] != handle)
+    owned = [path for path, znode in _server.tree.items()
+        if znode.owner == handle + 1]
+    for path in sorted(owned, reverse=True):
+      _delete(path, -1)
+
+def _session(handle):
+  session = _sessions.get(handle)
+  if session is None or not session.alive:
+    raise InvalidStateException('invalid zhandle state')
+  session.requests += 1
+  return session
+
+def _parent(path):
+  return path.rsplit('/', 1)[0] or '/'
+
+# Each operation returns (status, result), and must be called with the
+# server lock held.
+
+def _get(path, handle, watcher):
+  znode = _server.tree.get(path)
+  if znode is None:
+    return NONODE, (None, None)
+  if watcher is not None:
+    _server.data_w.setdefault(path, _pyset()).add((handle, watcher))
+  return OK, (znode.value, dict(znode.stat))
+
+def _get_children(path, handle, watcher):
+  znode = _server.tree.get(path)
+  if znode is None:
+    return NONODE, None
+  if watcher is not None:
+    _server.child_w.setdefault(path, _pyset()).add((handle, watcher))
+  return OK, sorted(child.rsplit('/', 1)[1] for child in znode.children)
+
+def _exists(path, handle, watcher):
+  znode = _server.tree.get(path)
+  if watcher is not None:
+    table = _server.exist_w if znode is None else _server.data_w
+    table.setdefault(path, _pyset()).add((handle, watcher))
+  if znode is None:
+    return NONODE, None
+  return OK, dict(znode.stat)
+
+def _create(path, value, flags, handle):
+  parent = _server.tree.get(_parent(path))
+  if parent is None:
+    return NONODE, None
+  if parent.owner:
+    return NOCHILDRENFOREPHEMERALS, None
+  if flags & SEQUENCE:
+    path = '%s%010d' % (path, parent.stat['cversion'])
+  if path in _server.tree:
+    return NODEEXISTS, None
+  owner = handle + 1 if flags & EPHEMERAL else 0
+  _server.tree[path] = _Znode(value, owner, next(_server.zxid))
+  parent.children.add(path)
+  parent.stat['cversion']    += 1
+  parent.stat['numChildren'] += 1
+  parent.stat['pzxid']        = next(_server.zxid)
+  _server.fire(_server.exist_w, path, CREATED_EVENT)
+  _server.fire(_server.child_w, _parent(path), CHILD_EVENT)
+  return OK, path
+
+def _set(path, value, version):
+  znode = _server.tree.get(path)
+  if znode is None:
+    return NONODE, None
+  if version != -1 and version != znode.stat['version']:
+    return BADVERSION, None
+  znode.value = value
+  znode.stat['version']   += 1
+  znode.stat['mzxid']      = next(_server.zxid)
+  znode.stat['mtime']      = int(time.time() * 1000)
+  znode.stat['dataLength'] = len(value or '')
+  _server.fire(_server.data_w, path, CHANGED_EVENT)
+  return OK, dict(znode.stat)
+
+def _delete(path, version):
+  znode = _server.tree.get(path)
+  if znode is None:
+    return NONODE, None
+  if version != -1 and version != znode.stat['version']:
+    return BADVERSION, None
+  if znode.children:
+    return NOTEMPTY, None
+  del _server.tree[path]
+  parent = _server.tree[_parent(path)]
+  parent.children.discard(path)
+  parent.stat['cversion']    += 1
+  parent.stat['numChildren'] -= 1
+  parent.stat['pzxid']        = next(_server.zxid)
+  _server.fire(_server.data_w, path, DELETED_EVENT)
+  _server.fire(_server.child_w, path, DELETED_EVENT)
+  _server.fire(_server.child_w, _parent(path), CHILD_EVENT)
+  return OK, None
+
+def _async(handle, op, completion, unpack):
+  session = _session(handle)
+  with _server.lock:
+    status, result = op(session)
+    if completion is not None:
+      args = unpack(session, result)
+      session.deliver(lambda: completion(handle, status, *args))
+  return OK
+
+def _sync(handle, op):
+  session = _session(handle)
+  with _server.lock:
+    status, result = op(session)
+  if status != OK:
+    raise _EXCEPTIONS[status](zerror(status))
+  return session, result
+
+def aget(handle, path, watcher=None, completion=None):
+  return _async(handle,
+      lambda s: _get(s.abs(path), handle, watcher),
+      completion,
+      lambda s, result: result)
+
+def aget_children(handle, path, watcher=None, completion=None):
+  return _async(handle,
+      lambda s: _get_children(s.abs(path), handle, watcher),
+      completion,
+      lambda s, result: (result,))
+
+def aexists(handle, path, watcher=None, completion=None):
+  return _async(handle,
+      lambda s: _exists(s.abs(path), handle, watcher),
+      completion,
+      lambda s, result: (result,))
+
+def acreate(handle, path, value, acl, flags=0, completion=None):
+  return _async(handle,
+      lambda s: _create(s.abs(path), value, flags, handle),
+      completion,
+      lambda s, result: (s.rel(result),))
+
+def aset(handle, path, value, version=-1, completion=None):
+  return _async(handle,
+      lambda s: _set(s.abs(path), value, version),
+      completion,
+      lambda s, result: (result,))
+
+def adelete(handle, path, version=-1, completion=None):
+  return _async(handle,
+      lambda s: _delete(s.abs(path), version),
+      completion,
+      lambda s, result: ())
+
+def get(handle, path, watcher=None):
+  return _sync(handle, lambda s: _get(s.abs(path), handle, watcher))[1]
+
+def get_children(handle, path, watcher=None):
+  return _sync(handle,
+      lambda s: _get_children(s.abs(path), handle, watcher))[1]
+
+def exists(handle, path, watcher=None):
+  session = _session(handle)
+  with _server.lock:
+    return _exists(session.abs(path), handle, watcher)[1]
+
+def create(handle, path, value, acl, flags=0):
+  session, created = _sync(handle,
+      lambda s: _create(s.abs(path), value, flags, handle))
+  return session.rel(created)
+
+def set(handle, path, value, version=-1):
+  _sync(handle, lambda s: _set(s.abs(path), value, version))
+  return OK
+
+def set2(handle, path, value, version=-1):
+  return _sync(handle, lambda s: _set(s.abs(path), value, version))[1]
+
+def delete(handle, path, version=-1):
+  _sync(handle, lambda s: _delete(s.abs(path), version))
+  return OK
+
+def handles():
+  """List the handles that are currently open."""
+  return sorted(_sessions)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+"""Benchmarks for zkmirror, run against the in-process fake zookeeper module
+in fakezk.py so that no ensemble is needed. Results are written as JSON, one
+entry per benchmark, for comparison between runs:
+
+  python bench/run.py [--scale N] [--output FILE] [benchmark ...]
+
+With no benchmark names, every benchmark is run. --scale multiplies the
+number of nodes and updates each benchmark uses.
+"""
+from collections import OrderedDict
+import contextlib
+import threading
+import platform
+import json
+import time
+import gc
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import fakezk
+sys.modules['zookeeper'] = fakezk
+
+import zkmirror
+from zkmirror.recipes import Queue
+
+BENCHMARKS = OrderedDict()
+
+def benchmark(fn):
+  BENCHMARKS[fn.__name__[len('bench_'):]] = fn
+  return fn
+
+@contextlib.contextmanager
+def quiet():
+  """zkmirror prints as it works; keep that out of the results."""
+  saved = sys.stdout
+  sys.stdout = open(os.devnull, 'w')
+  try:
+    yield
+  finally:
+    sys.stdout.close()
+    sys.stdout = saved
+
+def wait_until(ready, timeout=60):
+  giveup = time.time() + timeout
+  while not ready():
+    if time.time() > giveup:
+      raise RuntimeError('benchmark timed out')
+    time.sleep(0.001)
+
+def percentiles(samples):
+  """Summarize latencies given in seconds as microseconds."""
+  samples = sorted(samples)
+  def pick(fraction):
+    return samples[min(len(samples)-1, int(len(samples) * fraction))] * 1e6
+  return {
+      'p50_us':  pick(0.50),
+      'p90_us':  pick(0.90),
+      'p99_us':  pick(0.99),
+      'max_us':  samples[-1] * 1e6,
+      'mean_us': sum(samples) / len(samples) * 1e6,
+      }
+
+def seed(paths, value='v'):
+  """Create paths on the fake server through a throwaway mirror."""
+  mirror = zkmirror.Mirror().connect()
+  mirror.ensure_paths(paths, value)
+  mirror.close()
+
+def resident_bytes():
+  try:
+    with open('/proc/self/statm') as statm:
+      return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+  except IOError:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+@benchmark
+def bench_get_latency(scale):
+  """Time get(path).value() for nodes the mirror hasn't seen (cold) and for
+  nodes it already holds (warm).
+  """
+  count = 1000 * scale
+  paths = ['/latency/%d' % idx for idx in range(count)]
+  seed(paths)
+  mirror = zkmirror.Mirror().connect()
+
+  cold = []
+  for path in paths:
+    start = time.time()
+    mirror.get(path).value()
+    cold.append(time.time() - start)
+
+  warm = []
+  start_all = time.time()
+  for path in paths * 5:
+    start = time.time()
+    mirror.get(path).value()
+    warm.append(time.time() - start)
+  elapsed = time.time() - start_all
+  mirror.close()
+
+  metrics = {'warm_reads_per_s': len(warm) / elapsed}
+  metrics.update(('cold_' + key, val) for key, val in percentiles(cold).items())
+  metrics.update(('warm_' + key, val) for key, val in percentiles(warm).items())
+  return {'nodes': count}, metrics
+
+@benchmark
+def bench_get_many(scale):
+  """Read a batch of nodes on a cold mirror, a few of them missing, with
+  one get_many call and with a get(path).value() call per node.
+  """
+  count   = 2000 * scale
+  paths   = ['/many/%d' % idx for idx in range(count)]
+  missing = ['/many/missing/%d' % idx for idx in range(50)]
+  seed(paths)
+  results = {}
+
+  mirror = zkmirror.Mirror().connect()
+  start  = time.time()
+  mirror.get_many(paths + missing)
+  results['get_many_s'] = time.time() - start
+  mirror.close()
+
+  mirror = zkmirror.Mirror().connect()
+  start  = time.time()
+  for path in paths + missing:
+    try:
+      mirror.get(path).value()
+    except zkmirror.NoNodeException:
+      pass
+  results['serial_s'] = time.time() - start
+  mirror.close()
+  return {'nodes': count, 'missing': len(missing)}, results
+
+@benchmark
+def bench_watcher_fanout(scale):
+  """Push updates to one node carrying many watchers and time how long it
+  takes for every watcher to see every update.
+  """
+  watchers = 100
+  updates  = 50 * scale
+  results  = {}
+  for workers in (1, 4):
+    fakezk.reset()
+    mirror = zkmirror.Mirror(workers=workers).connect()
+    node   = mirror.create('/fanout', '0')
+    node.value()
+    seen   = [0]
+    def count(_value):
+      seen[0] += 1
+    for key in range(watchers):
+      node.addValueWatcher(key, count)
+
+    start = time.time()
+    for idx in range(updates):
+      node.set(str(idx), idx)
+    wait_until(lambda: seen[0] >= watchers * updates)
+    elapsed = time.time() - start
+    mirror.close()
+    results['deliveries_per_s_%d_workers' % workers] = seen[0] / elapsed
+  return {'watchers': watchers, 'updates': updates}, results
+
+@benchmark
+def bench_resync(scale):
+  """Expire the sessions of a mirror holding many nodes, and time how long it
+  takes to re-establish every node's watches on the new sessions, with the
+  nodes on one session, spread over four, and on one session watching only
+  their values.
+  """
+  count   = 2000 * scale
+  paths   = ['/resync/%d/%d' % (idx % 50, idx) for idx in range(count)]
+  results = {}
+  for sessions, watch, label in (
+      (1, zkmirror.WATCH_BOTH,  '1_sessions'),
+      (4, zkmirror.WATCH_BOTH,  '4_sessions'),
+      (1, zkmirror.WATCH_VALUE, 'value_only')):
+    fakezk.reset()
+    seed(paths)
+    mirror = zkmirror.Mirror(sessions=sessions).connect()
+    nodes  = [mirror.get(path, watch) for path in paths]
+    for node in nodes:
+      node.value()
+    total  = len(nodes)
+    per    = 2 if watch == zkmirror.WATCH_BOTH else 1
+
+    before = set(fakezk.handles())
+    start  = time.time()
+    for handle in before:
+      fakezk.expire(handle)
+    wait_until(lambda: len(set(fakezk.handles()) - before) >= sessions)
+    fresh  = list(set(fakezk.handles()) - before)
+    # Every node needs a get, and a children listing if it watches them,
+    # answered on the new sessions
+    wait_until(lambda: sum(fakezk.counters(handle)[1] for handle in fresh)
+        >= per * total)
+    elapsed = time.time() - start
+    mirror.close()
+    results['seconds_%s' % label]     = elapsed
+    results['nodes_per_s_%s' % label] = total / elapsed
+  return {'nodes': count}, results
+
+@benchmark
+def bench_memory(scale):
+  """Measure how much resident memory each mirrored node costs, with a 100
+  byte value loaded.
+  """
+  count = 5000 * scale
+  paths = ['/memory/%d/%d' % (idx % 100, idx) for idx in range(count)]
+  seed(paths, 'x' * 100)
+  gc.collect()
+  before = resident_bytes()
+  mirror = zkmirror.Mirror().connect()
+  for path in paths:
+    mirror.get(path)
+  for path in paths:
+    mirror.get(path).value()
+  gc.collect()
+  used = resident_bytes() - before
+  mirror.close()
+  return {'nodes': count, 'value_bytes': 100}, {
+      'bytes_per_node': float(used) / count,
+      }
+
+@benchmark
+def bench_queue(scale):
+  """Push items through the queue recipe: one at a time and in batches, and
+  then drained by several consumers, each with its own mirror.
+  """
+  count    = 2000 * scale
+  batch    = 100
+  workers  = 4
+  mirror   = zkmirror.Mirror().connect()
+  queue    = Queue(mirror, '/queue')
+
+  start = time.time()
+  for idx in range(count):
+    queue.put(str(idx))
+  single_put = count / (time.time() - start)
+
+  start = time.time()
+  for idx in range(0, count, batch):
+    queue.put_many([str(count + val) for val in range(idx, idx + batch)])
+  batch_put = count / (time.time() - start)
+
+  taken = []
+  def consume():
+    own   = zkmirror.Mirror().connect()
+    mine  = Queue(own, '/queue')
+    while True:
+      items = mine.take_many(batch, 1)
+      if not items:
+        break
+      taken.extend(items)
+    own.close()
+  threads = [threading.Thread(target=consume) for _ in range(workers)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  wait_until(lambda: len(taken) >= 2 * count)
+  take = len(taken) / (time.time() - start)
+  for thread in threads:
+    thread.join()
+  mirror.close()
+  return {'items': 2 * count, 'batch': batch, 'consumers': workers}, {
+      'single_puts_per_s': single_put,
+      'batch_puts_per_s':  batch_put,
+      'takes_per_s':       take,
+      'lost_items':        2 * count - len(set(taken)),
+      }
+
+def main(argv):
+  scale  = 1
+  output = None
+  names  = []
+  args   = list(argv)
+  while args:
+    arg = args.pop(0)
+    if arg == '--scale':
+      scale = int(args.pop(0))
+    elif arg == '--output':
+      output = args.pop(0)
+    elif arg in BENCHMARKS:
+      names.append(arg)
+    else:
+      sys.stderr.write('unknown benchmark %r; choose from %s\n'
+          % (arg, ', '.join(BENCHMARKS)))
+      return 2
+
+  results = []
+  for name in names or list(BENCHMARKS):
+    fakezk.reset()
+    with quiet():
+      start = time.time()
+      params, metrics = BENCHMARKS[name](scale)
+      elapsed = time.time() - start
+    params['scale'] = scale
+    results.append({
+      'name':     name,
+      'params':   params,
+      'metrics':  metrics,
+      'wall_s':   elapsed,
+      })
+    sys.stderr.write('%s done in %.2fs\n' % (name, elapsed))
+
+  report = json.dumps({
+    'python':    platform.python_version(),
+    'timestamp': time.time(),
+    'results':   results,
+    }, indent=2, sort_keys=True)
+  if output:
+    with open(output, 'w') as out:
+      out.write(report + '\n')
+  else:
+    print report
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -6,7 +6,7 @@ setup(name='zkmirror',
       author='Jay Groven',
       author_email='tsuraan@gmail.com',
       url='github.com/tsuraan/zkmirror',
-      packages=['zkmirror'],
+      packages=['zkmirror', 'zkmirror.recipes'],
       install_requires = [],
      )
 
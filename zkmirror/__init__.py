@@ -1,4 +1,8 @@
 from .mirror import Mirror
+from .codec import RAW
+from .codec import JSON
+from .codec import PICKLE
+from .codec import ZLIB_JSON
 from .zk import BadVersionException
 from .zk import NodeExistsException
 from .zk import ZooKeeperException
@@ -7,11 +11,19 @@ from .zk import ZooServerProblem
 from .zk import NoNodeException
 from .zk import EPHEMERAL
 from .zk import SEQUENCE
+from .node import WATCH_NONE
+from .node import WATCH_VALUE
+from .node import WATCH_CHILDREN
+from .node import WATCH_BOTH
 
 SEQUENTIAL=SEQUENCE
 
 __all__ = [
     Mirror,
+    RAW,
+    JSON,
+    PICKLE,
+    ZLIB_JSON,
     BadVersionException,
     NodeExistsException,
     ZooKeeperException,
@@ -21,5 +33,9 @@ __all__ = [
     EPHEMERAL,
     SEQUENCE,
     SEQUENTIAL,
+    WATCH_NONE,
+    WATCH_VALUE,
+    WATCH_CHILDREN,
+    WATCH_BOTH,
     ]
 
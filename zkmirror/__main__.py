@@ -1,6 +1,7 @@
 from __future__ import print_function
 from .mirror import Mirror
 from .zk import ZooServerProblem
+from .stats import format_stats
 import zookeeper
 import time
 import uuid
@@ -39,6 +40,13 @@ elif args == ['functions']:
       if attr == attr.lower() and not attr.startswith('_')]
   for attr in things:
     print(attr)
+elif args[:1] == ['stats']:
+  # Mirror the top of the tree from the given servers for a few seconds, and
+  # show what that took
+  m=Mirror().connect(*args[1:])
+  m.get_tree('/', depth=1)
+  time.sleep(3)
+  print('\n'.join(format_stats(m.stats())))
 else:
   m=Mirror().connect()
   root=m.get('/')
@@ -0,0 +1,147 @@
+"""An asyncio front end for Mirror.
+
+AsyncMirror and AsyncNode wrap a Mirror and its nodes so that event loop code
+never blocks on zookeeper: reads and writes return asyncio futures, and
+updates can be consumed as streams instead of through callbacks on zkmirror's
+own threads. Outcomes are handed to the loop with call_soon_threadsafe from
+whichever zookeeper thread produces them.
+
+This needs asyncio, or trollius, its python 2 backport.
+"""
+try:
+  import asyncio
+except ImportError:
+  import trollius as asyncio
+
+from .zk import OperationTimeoutException
+
+def _to_loop(loop, future, timeout=None):
+  """Return an asyncio future on loop that completes like the zkmirror
+  future does. If timeout is given and passes first, the asyncio future
+  fails with OperationTimeoutException.
+  """
+  result = asyncio.Future(loop=loop)
+  def transfer(done):
+    if result.done():
+      return
+    exc = done.exception()
+    if exc is not None:
+      result.set_exception(exc)
+    else:
+      result.set_result(done.result())
+  def expire():
+    if not result.done():
+      result.set_exception(OperationTimeoutException())
+      # Nothing will pick the answer up now
+      future._abandon()
+  if timeout is not None:
+    loop.call_soon_threadsafe(loop.call_later, timeout, expire)
+  future.add_done_callback(
+      lambda done: loop.call_soon_threadsafe(transfer, done))
+  return result
+
+class AsyncMirror(object):
+  def __init__(self, mirror, loop=None):
+    self.__mirror = mirror
+    self.__loop   = loop or asyncio.get_event_loop()
+
+  @property
+  def mirror(self):
+    return self.__mirror
+
+  def get(self, path, watch=None):
+    """Get an AsyncNode for path. This doesn't wait on zookeeper. watch
+    works as it does for Mirror.get.
+    """
+    return AsyncNode(self.__mirror.get(path, watch), self.__loop)
+
+  def create(self, path, value='', flags=0):
+    """Create a node at path. Returns an asyncio future whose result is the
+    new AsyncNode.
+    """
+    return _to_loop(self.__loop, self.__mirror.acreate(path, value, flags)
+        ._then(lambda node: AsyncNode(node, self.__loop)))
+
+class AsyncNode(object):
+  def __init__(self, node, loop):
+    self.__node = node
+    self.__loop = loop
+
+  @property
+  def path(self):
+    return self.__node.path
+
+  @property
+  def node(self):
+    """The underlying Node, for the blocking API.
+    """
+    return self.__node
+
+  def value(self, timeout=5, codec=None):
+    """Returns an asyncio future for this node's (value, meta) pair. It fails
+    with NoNodeException if the node doesn't exist, and with
+    OperationTimeoutException if zookeeper doesn't answer within timeout
+    seconds.
+    """
+    return _to_loop(self.__loop, self.__node.avalue(codec), timeout)
+
+  def children(self, timeout=5):
+    """Returns an asyncio future for the list of this node's children; it
+    fails like value() does.
+    """
+    return _to_loop(self.__loop, self.__node.achildren(), timeout)
+
+  def create(self, value=''):
+    return _to_loop(self.__loop, self.__node.acreate(value)
+        ._then(lambda node: self))
+
+  def set(self, value, version):
+    """Returns an asyncio future whose result is the node's new Meta.
+    """
+    return _to_loop(self.__loop, self.__node.aset(value, version))
+
+  def delete(self, version):
+    return _to_loop(self.__loop, self.__node.adelete(version))
+
+  def value_updates(self, codec=None):
+    """Returns an UpdateStream of the (value, meta) pairs this node takes on
+    from now on, with None when the node is deleted.
+    """
+    stream = UpdateStream(self.__loop, self.__node.delValueWatcher)
+    self.__node.addValueWatcher(stream, stream._put, codec=codec)
+    return stream
+
+  def child_updates(self):
+    """Returns an UpdateStream of this node's children lists from now on,
+    with None when the node is deleted.
+    """
+    stream = UpdateStream(self.__loop, self.__node.delChildWatcher)
+    self.__node.addChildWatcher(stream, stream._put)
+    return stream
+
+class UpdateStream(object):
+  """Updates from a node's watcher, queued up on the event loop. Iterate
+  over it with "async for", or call next() for a future of the next update.
+  close() stops the watcher.
+  """
+  def __init__(self, loop, unwatch):
+    self.__loop    = loop
+    self.__queue   = asyncio.Queue(loop=loop)
+    self.__unwatch = unwatch
+
+  def next(self):
+    """Returns a future for the next update.
+    """
+    return asyncio.ensure_future(self.__queue.get(), loop=self.__loop)
+
+  def close(self):
+    self.__unwatch(self)
+
+  def __aiter__(self):
+    return self
+
+  def __anext__(self):
+    return self.next()
+
+  def _put(self, update):
+    self.__loop.call_soon_threadsafe(self.__queue.put_nowait, update)
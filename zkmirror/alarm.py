@@ -0,0 +1,95 @@
+"""Timed waits on conditions that wake up as soon as they're notified.
+
+In python 2, Condition.wait(timeout) doesn't block on the condition: it
+polls, sleeping for up to 50ms between looks, so a thread waiting for a value
+that arrives right away still sleeps for a good part of that. An untimed
+wait() blocks properly, so wait() here does that instead, and has one shared
+alarm thread notify the condition when the timeout runs out. Only the alarm
+thread polls, and lateness there only delays timeouts, never values.
+"""
+from threading import Condition, Lock, Thread
+import atexit
+import heapq
+import itertools
+import time
+
+def wait(cond, timeout=None):
+  """Wait on cond, which the caller must hold, until it is notified or
+  timeout seconds pass. Like Condition.wait, this can return early, so
+  callers should check what they're waiting for and loop.
+  """
+  if timeout is None:
+    cond.wait()
+    return
+  if timeout <= 0:
+    return
+  alarm = _ALARMS.add(cond, time.time() + timeout)
+  if alarm is None:
+    cond.wait(timeout)
+    return
+  try:
+    cond.wait()
+  finally:
+    alarm[-1] = None
+
+class _Alarms(object):
+  def __init__(self):
+    self.__cond    = Condition(Lock())
+    self.__heap    = []
+    self.__seq     = itertools.count()
+    self.__thread  = None
+    self.__stopped = False
+
+  def add(self, cond, deadline):
+    """Notify cond at deadline. Returns the alarm, whose last item can be set
+    to None to cancel it, or None once the alarms have been stopped.
+    """
+    alarm = [deadline, next(self.__seq), cond]
+    with self.__cond:
+      if self.__stopped:
+        return None
+      if self.__thread is None:
+        self.__thread = Thread(target=self._run, name='zkmirror-alarms')
+        self.__thread.daemon = True
+        self.__thread.start()
+      heapq.heappush(self.__heap, alarm)
+      if self.__heap[0] is alarm:
+        self.__cond.notify()
+    return alarm
+
+  def stop(self):
+    """Stop the alarm thread, which otherwise trips over the interpreter
+    tearing down modules at exit.
+    """
+    with self.__cond:
+      thread, self.__thread = self.__thread, None
+      self.__stopped = True
+      self.__cond.notify()
+    if thread is not None:
+      thread.join(1)
+
+  def _run(self):
+    while True:
+      due = []
+      with self.__cond:
+        if self.__stopped:
+          return
+        while self.__heap and self.__heap[0][-1] is None:
+          heapq.heappop(self.__heap)
+        if not self.__heap:
+          self.__cond.wait()
+          continue
+        now = time.time()
+        while self.__heap and self.__heap[0][0] <= now:
+          due.append(heapq.heappop(self.__heap)[-1])
+        if not due:
+          self.__cond.wait(self.__heap[0][0] - now)
+          continue
+      for cond in due:
+        if cond is None:
+          continue
+        with cond:
+          cond.notify_all()
+
+_ALARMS = _Alarms()
+atexit.register(_ALARMS.stop)
@@ -1,22 +1,39 @@
+from collections import OrderedDict
+from threading import Lock
+
 from .zk import fix_path
 
 class ChrootMirror(object):
   """A Mirror-like class that prepends a fixed path onto any path requests,
   and that returns Node-like objects that similarly modify their path
   attribute.
+
+  The wrappers for plain nodes are cached by path, at most max_wrappers of
+  them, so asking for the same path again returns the same wrapper for as
+  long as the mirror keeps the same node there. To avoid rewriting paths in
+  python at all, a Mirror can instead be connected with a chroot of its own;
+  see Mirror.connect. The cache is locked, since request handlers share a
+  ChrootMirror across threads.
   """
   @fix_path
-  def __init__(self, path, mirror):
+  def __init__(self, path, mirror, max_wrappers=10000):
     self.__chroot          = path
     self.__mirror          = mirror
+    self.__wrappers        = OrderedDict()
+    self.__wraplck         = Lock()
+    self.__maxwrap         = max_wrappers
     self.time_disconnected = mirror.time_disconnected
     self.is_connected      = mirror.is_connected
 
   @fix_path
-  def get(self, path):
+  def get(self, path, watch=None):
     chrooted = self.__chroot + path
-    return ChrootNode(self.__chroot,
-        self.__mirror.get(chrooted))
+    return self._wrap(path, self.__mirror.get(chrooted, watch))
+
+  @fix_path
+  def get_tree(self, path, depth=None):
+    chrooted = self.__chroot + path
+    return self._wrap(path, self.__mirror.get_tree(chrooted, depth))
 
   @fix_path
   def get_json(self, path):
@@ -25,16 +42,34 @@ class ChrootMirror(object):
         self.__mirror.get_json(chrooted))
 
   @fix_path
-  def create(self, path, value='', flags=0):
+  def get_large(self, path, *args):
     chrooted = self.__chroot + path
     return ChrootNode(self.__chroot,
-        self.__mirror.create(chrooted, value, flags))
+        self.__mirror.get_large(chrooted, *args))
 
   @fix_path
-  def create_r(self, path, value=''):
+  def get_codec(self, path, codec):
     chrooted = self.__chroot + path
     return ChrootNode(self.__chroot,
-        self.__mirror.create_r(chrooted, value))
+        self.__mirror.get_codec(chrooted, codec))
+
+  @fix_path
+  def create(self, path, value='', flags=0):
+    chrooted = self.__chroot + path
+    node     = self.__mirror.create(chrooted, value, flags)
+    # With SEQUENCE, the node's path isn't the one asked for
+    return self._wrap(None, node)
+
+  @fix_path
+  def acreate(self, path, value='', flags=0):
+    chrooted = self.__chroot + path
+    return self.__mirror.acreate(chrooted, value, flags)._then(
+        lambda node: self._wrap(None, node))
+
+  @fix_path
+  def create_r(self, path, value=''):
+    chrooted = self.__chroot + path
+    return self._wrap(path, self.__mirror.create_r(chrooted, value))
 
   @fix_path
   def create_json(self, path, value, flags=0):
@@ -51,29 +86,58 @@ class ChrootMirror(object):
   @fix_path
   def ensure_exists(self, path, value=''):
     chrooted = self.__chroot + path
-    return ChrootNode(self.__chroot,
-        self.__mirror.ensure_exists(chrooted, value))
+    return self._wrap(path, self.__mirror.ensure_exists(chrooted, value))
+
+  def _wrap(self, path, node):
+    """Return the cached wrapper for node, making a new one if there's none
+    or if the cached one wraps a node the mirror has since replaced. path is
+    node's path relative to the chroot, if known.
+    """
+    if path is None:
+      wrapper = ChrootNode(self.__chroot, node)
+      path    = wrapper.path
+    else:
+      wrapper = None
+    with self.__wraplck:
+      cached = self.__wrappers.get(path)
+    if cached is not None and cached._wrapped() is node:
+      return cached
+    if wrapper is None:
+      wrapper = ChrootNode(self.__chroot, node, path)
+    with self.__wraplck:
+      self.__wrappers[path] = wrapper
+      while len(self.__wrappers) > self.__maxwrap:
+        self.__wrappers.popitem(last=False)
+    return wrapper
 
 class ChrootNode(object):
   """A Node-like class that wraps Nodes and fakes their "path" attribute to
-  not include a path base.
+  not include a path base. The relative path is worked out once, unless it's
+  given, and methods looked up on the wrapped node are kept on the wrapper,
+  so later calls don't go through __getattr__ again.
   """
   @fix_path
-  def __init__(self, path, node):
-    self.__chroot = path
-    self.__node   = node
+  def __init__(self, path, node, relative=None):
+    self.__node = node
+    if relative is None:
+      relative = node.path
+      if relative == path or relative.startswith(path + '/'):
+        relative = relative[len(path):]
+      relative = relative or '/'
+    self.__path = relative
 
   @property
   def path(self):
-    p = self.__node.path
-    if p == self.__chroot or p.startswith(self.__chroot+'/'):
-      p = p[len(self.__chroot):]
-    if not p:
-      p = '/'
-    return p
+    return self.__path
+
+  def _wrapped(self):
+    return self.__node
 
   def __getattr__(self, attr):
     """Pass everything else through to wrapped node
     """
-    return getattr(self.__node, attr)
+    value = getattr(self.__node, attr)
+    if callable(value):
+      setattr(self, attr, value)
+    return value
 
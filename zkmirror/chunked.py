@@ -0,0 +1,289 @@
+"""Values too big for a single znode, split across child znodes.
+
+A large value lives at its path as a JSON manifest listing its chunks, in
+order. The value is cut into chunk_size slices which are compressed one by
+one and stored as children of the manifest node, named after the SHA-1 of
+their contents and a token unique to the write that created them. Writing a
+new value reuses the chunks of the manifest it replaces that still match,
+creates the rest, switches the manifest over with a versioned set, and then
+deletes chunks the old manifest used that the new one doesn't.
+
+Chunks are only ever shared between a manifest and the one that replaces it,
+so they can be deleted safely: a writer only deletes the chunks of a manifest
+version it has replaced, and any other write that meant to reuse them was
+checked against that version, so it fails and starts over.
+
+Every chunk is an ordinary mirrored node, so chunk changes are mirrored
+individually, and watchers are only told about a manifest version once all
+of its chunks have arrived.
+"""
+from threading import Lock
+import traceback
+import hashlib
+import json
+import time
+import uuid
+import zlib
+
+from .zk import BadVersionException
+from .zk import NoNodeException
+from .zk import OperationTimeoutException
+from .codec import JSON
+from .node import WATCH_VALUE
+
+DEFAULT_CHUNK_SIZE = 512 * 1024
+
+class ChunkedNode(object):
+  def __init__(self, mirror, path, chunk_size=DEFAULT_CHUNK_SIZE, level=6):
+    self.__mirror     = mirror
+    self.__path       = path
+    self.__chunk_size = chunk_size
+    self.__level      = level
+    self.__node       = mirror.get(path, WATCH_VALUE)
+    self.__lock       = Lock()
+    self.__cached     = None
+    self.__watchers   = {}
+    self.__watched    = set()
+    self.__notified   = None
+    self.__chunks     = set()
+
+  @property
+  def path(self):
+    return self.__path
+
+  def value(self, timeout=5):
+    """Get the reassembled value stored here, and the manifest's metadata.
+    Raises NoNodeException if there's no value here. The chunks are all
+    requested at once, and the whole read is bounded by timeout.
+    """
+    deadline = time.time() + timeout
+    manifest, meta = self.__node.value(timeout, JSON)
+    while True:
+      try:
+        return self._assemble(manifest, meta, self._reader(manifest, deadline))
+      except NoNodeException:
+        # A writer may have replaced the value and deleted the chunks since
+        # the mirrored manifest was read; start over if zookeeper has a newer
+        # one
+        raw, latest = self.__mirror._aread(self.__path, via=self.__path
+            ).result(max(0, deadline - time.time()))
+        if latest.version == meta.version and latest.czxid == meta.czxid:
+          raise
+        manifest, meta = json.loads(raw), latest
+
+  def create(self, value, timeout=5):
+    """Store value here; this fails with NodeExistsException if there is
+    something here already.
+    """
+    self.__node.create('null')
+    self.set(value, 0, timeout)
+
+  def set(self, value, version=-1, timeout=5):
+    """Store value here, replacing whatever was here before. version is the
+    manifest version being replaced; with -1, the write is retried until it
+    wins, or timeout passes.
+    """
+    deadline = time.time() + timeout
+    token    = uuid.uuid4().hex[:12]
+    slices   = []
+    for start in xrange(0, len(value), self.__chunk_size):
+      chunk = zlib.compress(value[start:start+self.__chunk_size],
+          self.__level)
+      slices.append((hashlib.sha1(chunk).hexdigest(), chunk))
+
+    created  = {}
+    old, meta = self.__node.value(max(0, deadline - time.time()), JSON)
+    while True:
+      reusable = {}
+      for name in (old or {}).get('chunks', ()):
+        reusable.setdefault(name.split('-')[0], name)
+      names   = []
+      creates = []
+      for digest, chunk in slices:
+        name = created.get(digest) or reusable.get(digest)
+        if name is None:
+          name = created[digest] = '%s-%s' % (digest, token)
+          creates.append(self.__mirror._acreate(self._chunk_path(name), chunk,
+            via=self.__path))
+        names.append(name)
+      self.__mirror._await_materialized(creates, deadline)
+
+      manifest = json.dumps({'chunks': names, 'length': len(value)})
+      try:
+        self.__node.set(manifest,
+            meta.version if version == -1 else version)
+        break
+      except BadVersionException:
+        if version != -1 or time.time() >= deadline:
+          self._discard(created.values())
+          raise
+      # The mirrored manifest is behind; ask zookeeper for the current one
+      raw, meta = self.__mirror._aread(self.__path, via=self.__path).result(
+          max(0, deadline - time.time()))
+      old = json.loads(raw)
+
+    if old:
+      self._discard(set(old['chunks']) - set(names))
+
+  def delete(self, version=-1, timeout=5):
+    """Delete the value stored here, chunks and all. The manifest is emptied
+    first, so that writes reusing its chunks fail instead of pointing at
+    chunks that are going away.
+    """
+    deadline = time.time() + timeout
+    meta     = self.__node.set('null', version)
+    children = self.__mirror._aread_children(self.__path, via=self.__path
+        ).result(max(0, deadline - time.time()))
+    self._release_chunks(children)
+    deletes  = [self.__mirror._adelete(self._chunk_path(name), -1,
+      via=self.__path) for name in children]
+    for future in deletes:
+      exc = future.exception(max(0, deadline - time.time()))
+      if exc is not None and not isinstance(exc, NoNodeException):
+        raise exc
+    self.__node.delete(meta.version)
+
+  def addValueWatcher(self, key, fn):
+    """Add a function to be called with (value, meta) each time a new version
+    of the value has fully arrived, or with None if the value is deleted.
+    Exceptions thrown by fn are swallowed.
+    """
+    with self.__lock:
+      first = not self.__watchers
+      self.__watchers[key] = fn
+    if first:
+      self.__node.addValueWatcher(self._key(), self._manifest_changed)
+      pair = self.__node._immed_raw_value()
+      if pair is not None:
+        self._manifest_changed(pair.pair())
+
+  def delValueWatcher(self, key):
+    with self.__lock:
+      self.__watchers.pop(key, None)
+      last = not self.__watchers
+    if last:
+      self.__node.delValueWatcher(self._key())
+      self._watch_chunks(set())
+
+  def _key(self):
+    return ('chunked', id(self))
+
+  def _chunk_path(self, name):
+    return self.__path.rstrip('/') + '/' + name
+
+  def _discard(self, names):
+    """Stop mirroring the named chunks and delete them, without waiting.
+    """
+    self._release_chunks(names)
+    for name in names:
+      self.__mirror._adelete(self._chunk_path(name), -1, via=self.__path)
+
+  def _release_chunks(self, names):
+    """Stop mirroring the named chunks, unless somebody watches them. They
+    are released before they're deleted, so that their watches lapse instead
+    of being replaced with watches for their re-creation.
+    """
+    for name in names:
+      self.__mirror._release(self._chunk_path(name))
+
+  def _reader(self, manifest, deadline):
+    """Build the read function _assemble uses in value(). The first call
+    requests every chunk in manifest at once; each then waits for its own
+    chunk until deadline.
+    """
+    futures = {}
+    def read(name):
+      if not futures:
+        for each in manifest['chunks']:
+          if each not in futures:
+            futures[each] = self._chunk(each).avalue()
+      return futures[name].result(max(0, deadline - time.time()))[0]
+    return read
+
+  def _chunk(self, name):
+    """The node for the named chunk. Chunks never change and nobody lists
+    them, so only their values are watched.
+    """
+    return self.__mirror.get(self._chunk_path(name), WATCH_VALUE)
+
+  def _assemble(self, manifest, meta, read):
+    """Put the value described by manifest back together, using read to get
+    each chunk's stored data, given its name. The latest result is cached,
+    keyed on the manifest's version, and chunks earlier results used that
+    this one doesn't are released.
+    """
+    if not manifest:
+      # Created, but the first value isn't in place yet
+      raise NoNodeException
+    key    = (meta.czxid, meta.version)
+    cached = self.__cached
+    if cached is not None and cached[0] == key:
+      return cached[1], meta
+    value = ''.join([zlib.decompress(read(name))
+      for name in manifest['chunks']])
+    if len(value) != manifest['length']:
+      raise NoNodeException
+    names = set(manifest['chunks'])
+    with self.__lock:
+      self.__cached = (key, value)
+      unused, self.__chunks = self.__chunks - names, names
+    self._release_chunks(unused)
+    return value, meta
+
+  def _manifest_changed(self, pair):
+    if pair is None:
+      self._watch_chunks(set())
+      self._deliver(None, None)
+      return
+    manifest = json.loads(pair[0])
+    if not manifest:
+      return
+    self._watch_chunks(set(manifest['chunks']))
+    self._check()
+
+  def _watch_chunks(self, names):
+    """Keep value watchers on exactly the named chunks, so that we hear when
+    their data arrives.
+    """
+    with self.__lock:
+      added   = names - self.__watched
+      removed = self.__watched - names
+      self.__watched = set(names)
+    for name in removed:
+      self._chunk(name).delValueWatcher(self._key())
+    self._release_chunks(removed)
+    for name in added:
+      self._chunk(name).addValueWatcher(self._key(),
+          lambda _pair: self._check())
+
+  def _check(self):
+    """Tell watchers about the current manifest version, if all its chunks
+    have arrived and they haven't been told already.
+    """
+    data = self.__node._immed_raw_value()
+    if data is None:
+      return
+    def read(name):
+      chunk = self._chunk(name)._immed_raw_value()
+      if chunk is None:
+        raise OperationTimeoutException
+      return chunk.value
+    try:
+      manifest, meta = data.decoded(JSON)
+      value, meta    = self._assemble(manifest, meta, read)
+    except (NoNodeException, OperationTimeoutException, ValueError):
+      return
+    self._deliver((meta.czxid, meta.version), (value, meta))
+
+  def _deliver(self, key, update):
+    with self.__lock:
+      if key == self.__notified:
+        return
+      self.__notified = key
+      watchers = list(self.__watchers.values())
+    for fn in watchers:
+      try:
+        fn(update)
+      except:
+        print "large value watcher callback threw this:"
+        traceback.print_exc()
@@ -0,0 +1,56 @@
+import cPickle as pickle
+import json
+import zlib
+
+class Codec(object):
+  """Turns python values into the strings that get stored in zookeeper, and
+  back again. Decoded values are cached per node version, and shared by
+  every reader of that version, so callers must not modify what decode
+  returns.
+  """
+  def encode(self, value):
+    raise NotImplementedError
+
+  def decode(self, data):
+    raise NotImplementedError
+
+class RawCodec(Codec):
+  """Stores strings as they are."""
+  def encode(self, value):
+    return value
+
+  def decode(self, data):
+    return data
+
+class JsonCodec(Codec):
+  def encode(self, value):
+    return json.dumps(value)
+
+  def decode(self, data):
+    return json.loads(data)
+
+class PickleCodec(Codec):
+  """Stores pickles. Only use this for nodes that nobody untrusted can write
+  to; unpickling runs arbitrary code.
+  """
+  def encode(self, value):
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+  def decode(self, data):
+    return pickle.loads(data)
+
+class ZlibJsonCodec(Codec):
+  """Stores zlib-compressed JSON, for large values."""
+  def __init__(self, level=6):
+    self.__level = level
+
+  def encode(self, value):
+    return zlib.compress(json.dumps(value), self.__level)
+
+  def decode(self, data):
+    return json.loads(zlib.decompress(data))
+
+RAW       = RawCodec()
+JSON      = JsonCodec()
+PICKLE    = PickleCodec()
+ZLIB_JSON = ZlibJsonCodec()
@@ -0,0 +1,95 @@
+from threading import Thread, Lock, current_thread
+from Queue import Queue
+import traceback
+import time
+
+_STOP = object()
+
+class Dispatcher(object):
+  """Runs callbacks on a fixed pool of worker threads. Every callback is
+  submitted with a key (the path of the node it concerns, usually), and all
+  callbacks sharing a key go to the same worker, so they run in the order in
+  which they were submitted. A slow callback only holds up the keys that hash
+  onto its worker.
+  """
+  def __init__(self, workers=1, stats=None):
+    """If stats (a stats.Stats) is given, the time each callback takes to run
+    is recorded in it as 'callback'.
+    """
+    if workers < 1:
+      raise ValueError('a Dispatcher needs at least one worker')
+    self.__shards  = [_Shard(stats) for _ in range(workers)]
+    self.__threads = []
+    for idx, shard in enumerate(self.__shards):
+      thread = Thread(target=run_tasks, args=(shard,),
+          name='zkmirror-dispatch-%d' % idx)
+      thread.daemon = True
+      thread.start()
+      self.__threads.append(thread)
+
+  def submit(self, key, fn):
+    """Queue fn to be called, with no arguments, on the worker that owns key.
+    """
+    shard = self.__shards[hash(key) % len(self.__shards)]
+    shard.queue.put((time.time(), fn))
+
+  def stats(self):
+    """Return a list with one dict per worker, giving its queue depth, the
+    number of tasks it has run, and the average and longest time its tasks
+    waited in the queue before starting (its lag), in seconds.
+    """
+    return [shard.stats() for shard in self.__shards]
+
+  def close(self):
+    """Stop every worker once it has drained the tasks queued ahead of the
+    stop request.
+    """
+    for shard in self.__shards:
+      shard.queue.put((time.time(), _STOP))
+    me = current_thread()
+    for thread in self.__threads:
+      if thread is not me:
+        thread.join()
+
+class _Shard(object):
+  def __init__(self, stats):
+    self.queue     = Queue()
+    self.stats_to  = stats
+    self.__lock    = Lock()
+    self.__run     = 0
+    self.__lag     = 0.0
+    self.__lag_max = 0.0
+
+  def record(self, lag):
+    with self.__lock:
+      self.__run += 1
+      self.__lag += lag
+      if lag > self.__lag_max:
+        self.__lag_max = lag
+
+  def stats(self):
+    with self.__lock:
+      return {
+          'depth':   self.queue.qsize(),
+          'run':     self.__run,
+          'lag_avg': self.__lag / self.__run if self.__run else 0.0,
+          'lag_max': self.__lag_max,
+          }
+
+def run_tasks(shard):
+  try:
+    while True:
+      queued, function = shard.queue.get()
+      if function is _STOP:
+        return
+      start = time.time()
+      shard.record(start - queued)
+      try:
+        function()
+      except Exception:
+        print 'zkmirror asynchronous task failed like this:'
+        traceback.print_exc()
+      if shard.stats_to is not None:
+        shard.stats_to.record('callback', time.time() - start)
+  finally:
+    print 'run_tasks thread shutting down'
@@ -0,0 +1,112 @@
+from threading import Condition, Lock
+import traceback
+import time
+
+from .zk import OperationTimeoutException
+from . import alarm
+
+class Future(object):
+  """The eventual outcome of an asynchronous zookeeper request. Futures are
+  completed from within zookeeper's completion callbacks, so functions given
+  to add_done_callback must not wait on zookeeper themselves; they should
+  hand such work to Mirror._run_async instead.
+  """
+  def __init__(self):
+    self.__cond   = Condition(Lock())
+    self.__done   = False
+    self.__result = None
+    self.__exc    = None
+    self.__cbs    = []
+
+  def done(self):
+    """Returns True if the request has completed, successfully or not.
+    """
+    return self.__done
+
+  def result(self, timeout=None):
+    """Wait for the request to complete and return its result, or raise the
+    exception that it failed with. If timeout seconds pass before the request
+    completes, OperationTimeoutException is raised.
+    """
+    self._wait(timeout)
+    if self.__exc is not None:
+      raise self.__exc
+    return self.__result
+
+  def exception(self, timeout=None):
+    """Wait for the request to complete and return the exception it failed
+    with, or None if it succeeded.
+    """
+    self._wait(timeout)
+    return self.__exc
+
+  def add_done_callback(self, fn):
+    """Call fn with this future once it completes. If it already has, fn is
+    called right away.
+    """
+    with self.__cond:
+      if not self.__done:
+        self.__cbs.append(fn)
+        return
+    self._call(fn)
+
+  def _abandon(self):
+    """Give up waiting on the request: fail this with
+    OperationTimeoutException, unless it has already completed. Whatever
+    would have completed it is told through the done callbacks, so it can
+    forget about this.
+    """
+    self._set_exception(OperationTimeoutException())
+
+  def _then(self, fn):
+    """Return a new Future whose result is fn applied to this one's result;
+    failures are passed along untouched.
+    """
+    chained = Future()
+    def done(future):
+      if future.exception() is not None:
+        chained._set_exception(future.exception())
+        return
+      try:
+        chained._set_result(fn(future.result()))
+      except Exception as exc:
+        chained._set_exception(exc)
+    self.add_done_callback(done)
+    return chained
+
+  def _wait(self, timeout):
+    end = None if timeout is None else time.time() + timeout
+    with self.__cond:
+      while not self.__done:
+        if end is None:
+          alarm.wait(self.__cond)
+          continue
+        remaining = end - time.time()
+        if remaining <= 0:
+          raise OperationTimeoutException
+        alarm.wait(self.__cond, remaining)
+
+  def _set_result(self, result):
+    self._complete(result, None)
+
+  def _set_exception(self, exc):
+    self._complete(None, exc)
+
+  def _complete(self, result, exc):
+    with self.__cond:
+      if self.__done:
+        return
+      self.__result = result
+      self.__exc    = exc
+      self.__done   = True
+      self.__cond.notify_all()
+      cbs, self.__cbs = self.__cbs, []
+    for fn in cbs:
+      self._call(fn)
+
+  def _call(self, fn):
+    try:
+      fn(self)
+    except:
+      print 'future callback threw this:'
+      traceback.print_exc()
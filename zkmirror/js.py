@@ -1,29 +1,42 @@
 from .zk import BadVersionException
 from .zk import NodeExistsException
 from .zk import NoNodeException
-import json
+from .codec import JSON
 
-class JsNode(object):
-  def __init__(self, node):
-    self.__node = node
+class CodecNode(object):
+  """Wraps a Node so that the values read from and written to it go through
+  a codec. Each version of the node's value is decoded only once, however
+  many readers and watchers it has.
+  """
+  def __init__(self, node, codec):
+    self.__node  = node
+    self.__codec = codec
+
+  @property
+  def codec(self):
+    return self.__codec
 
   def value(self, timeout=5):
-    """Get the decode JSON value of whatever is stored at this node, and its
+    """Get the decoded value of whatever is stored at this node, and its
     metadata.
     """
-    val, meta = self.__node.value(timeout)
-    return json.loads(val), meta
+    return self.__node.value(timeout, self.__codec)
 
   def create(self, value):
-    """Create data at this path with the JSON encoding of the given value.
+    """Create data at this path with the encoding of the given value.
     """
-    self.__node.create(json.dumps(value))
+    self.__node.create(self.__codec.encode(value))
 
   def set(self, value, version):
-    """Set the value stored in zookeeper to the JSON encoding of the given
-    value.
+    """Set the value stored in zookeeper to the encoding of the given value.
     """
-    self.__node.set(json.dumps(value), version)
+    self.__node.set(self.__codec.encode(value), version)
+
+  def acreate(self, value):
+    return self.__node.acreate(self.__codec.encode(value))
+
+  def aset(self, value, version):
+    return self.__node.aset(self.__codec.encode(value), version)
 
   def update(self, updater):
     """the given updater function will be called on whatever is currently
@@ -50,14 +63,13 @@ class JsNode(object):
         except BadVersionException:
           continue
 
-  def addValueWatcher(self, key, fn):
-    def decoder(value):
-      if value is not None:
-        value = (json.loads(value[0]), value[1])
-      fn(value)
-    self.__node.addValueWatcher(key, decoder)
+  def addValueWatcher(self, key, fn, coalesce=False):
+    self.__node.addValueWatcher(key, fn, coalesce, self.__codec)
 
   def __getattr__(self, attr):
     """Ghetto Inheritance FTW!"""
     return getattr(self.__node, attr)
 
+class JsNode(CodecNode):
+  def __init__(self, node):
+    CodecNode.__init__(self, node, JSON)
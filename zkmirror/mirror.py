@@ -1,19 +1,42 @@
-from threading import Thread, Lock
-from Queue import Queue
+from collections import OrderedDict
+from threading import Lock
 import traceback
 import zookeeper
 import json
 import time
+import zlib
 import sys
 
 from .chroot import ChrootMirror
+from .dispatch import Dispatcher
+from .resync import Resync
+from .session import Session
+from .path import Path
+from .path import PathIndex
+from .stats import Stats
+from . import snapshot
+from .future import Future
 from .node import Node
+from .node import Meta
+from .node import WAIT_STATS
+from .node import COALESCE_STATS
+from .node import WATCH_VALUE
+from .node import WATCH_CHILDREN
+from .node import WATCH_BOTH
+from .chunked import ChunkedNode
+from .chunked import DEFAULT_CHUNK_SIZE
+from .js import CodecNode
 from .js import JsNode
 from .zk import ZooKeeperException
+from .zk import SessionExpiredException
 from .zk import NodeExistsException
-from .zk import NoNodeException
+from .zk import OperationTimeoutException
+from .zk import error_for
 from .zk import fix_path
+from .zk import normalize
+from .zk import ancestors
 from .zk import describe_state
+from .zk import describe_event
 from .zk import EXPIRED_SESSION_STATE
 from .zk import CONNECTED_STATE
 from .zk import CHANGED_EVENT
@@ -34,28 +57,58 @@ def debug(*args):
   sys.stderr.write(' '.join(map(str, args)) + "\n")
 
 class Mirror(object):
-  def __init__(self):
+  def __init__(self, workers=1, max_nodes=None, resync_inflight=256,
+      max_pending=10000, sessions=1):
+    """workers is the number of threads used to run watcher callbacks. Each
+    node's callbacks always run on the same thread, in order.
+
+    sessions is the number of zookeeper sessions to open. Paths are spread
+    across them by a hash of the path, and each session reconnects and
+    resyncs its own nodes. A node is always read, watched and written through
+    the same session, but with more than one, changes to different paths may
+    be seen in a different order than they were made.
+
+    If max_nodes is given, the mirror keeps at most that many nodes, evicting
+    the least recently fetched or read ones that have no watchers attached.
+    Evicted nodes are no longer kept up to date; reading from one puts it
+    back into the mirror.
+
+    When a session expires, every node has to be set up again on the new
+    session. resync_inflight limits how many nodes have requests outstanding
+    during that resync; nodes with watchers are resynced first, followed by
+    the most recently read.
+
+    Requests that fail while zookeeper is unreachable are queued to be
+    retried when we reconnect, at most max_pending of them per session. If
+    more than that fail, everything is resynced on reconnection instead.
+    """
     silence()
-    self.__q       = Queue()
-    self.__async   = Thread(target=run_tasks, args=(self.__q,))
-    self.__async.daemon = True
-    self.__async.start()
+    self.__stats   = Stats()
+    self.__async   = Dispatcher(workers, self.__stats)
 
-    self.__zk      = -1 
-    self.__state   = 0
+    self.__sessions = [Session(idx, max_pending) for idx in range(sessions)]
 
-    self.__nodes   = {}
+    self.__nodes   = OrderedDict()
+    # The same nodes, in a trie for subtree and ancestor queries
+    self.__index   = PathIndex()
     self.__nodelck = Lock()
-    self.__socklck = Lock()
+    self.__maxnode = max_nodes
+    self.__evicted = 0
+    # With max_nodes, the nodes that may be evicted, least recently used
+    # first, each with the time it was queued. Watched nodes are dropped from
+    # here as eviction comes across them, and come back once unwatched.
+    self.__lru     = OrderedDict()
 
     self.__missing = set()
     self.__misslck = Lock()
 
-    self.__disconnected = time.time()
+    # Roots of subtrees that are mirrored automatically, mapped to how many
+    # levels below the root are mirrored (None for everything)
+    self.__trees   = {}
+
+    self.__maxresync = resync_inflight
 
     self.__state_cbs = {}
-    # List of actions that failed while we were not connected
-    self.__pending = []
 
   def connstr(self):
     try:
@@ -63,7 +116,17 @@ class Mirror(object):
     except AttributeError:
       return None
 
-  def connect(self, *servers):
+  def connect(self, *servers, **kwargs):
+    """Connect to the given servers, each a host name or a (host, port) pair.
+
+    If chroot is given as a keyword argument, zookeeper itself roots every
+    path this mirror uses at chroot, so this mirror works like
+    mirror.chroot(chroot) without any path rewriting on our side. The chroot
+    node must already exist.
+    """
+    chroot = kwargs.pop('chroot', None)
+    if kwargs:
+      raise TypeError('unexpected arguments: %s' % ', '.join(kwargs))
     if not servers:
       servers = ('localhost',)
     servers = list(servers)
@@ -73,8 +136,11 @@ class Mirror(object):
         servers[idx] = (val, 2181)
 
     self.__initstr = ','.join('%s:%d' % pair for pair in servers)
+    if chroot is not None and normalize(chroot) != '/':
+      self.__initstr += normalize(chroot)
     try:
-      self._reconnect()
+      for session in self.__sessions:
+        self._reconnect(session)
     except ZooKeeperException:
       # This can happen if a server doesn't have a DNS entry, or it seems that
       # it can happen for other reasons, but either way we want to act as
@@ -84,54 +150,278 @@ class Mirror(object):
     return self
 
   def time_disconnected(self):
-    """Return how long we've been disconnected. Returns None if we are
+    """Return how long we've been disconnected (with several sessions, how
+    long the one that has been down longest has been). Returns None if we are
     currently connected.
     """
-    try:
-      return time.time() - self.__disconnected
-    except TypeError:
-      # self.__disconnected is None
+    down = [session.disconnected for session in self.__sessions
+        if session.disconnected is not None]
+    if not down:
       return None
+    return time.time() - min(down)
 
-  def is_connected(self):
+  def is_connected(self, path=None):
     """Returns True if we are currently connected to ZooKeeper, False if not.
+    If path is given, only the session serving path is considered.
+    """
+    if path is not None:
+      return not self._session(path).disconnected
+    return not any(session.disconnected for session in self.__sessions)
+
+  def stats(self):
+    """Return a dict describing what the mirror has been doing: counters of
+    watch events and session transitions, latency histograms for zookeeper
+    requests and callbacks, and the state of the pending queue, dispatcher,
+    node registry, resync, value waits and watcher coalescing.
+    """
+    snapshot = self.__stats.snapshot()
+    dispatch = self.__async.stats()
+    snapshot.update({
+        'state':    ','.join(describe_state(session.state)
+          for session in self.__sessions),
+        'sessions': len(self.__sessions),
+        'pending':  self.pending_stats(),
+        'dispatch': {
+          'depth':   sum(shard['depth'] for shard in dispatch),
+          'workers': dispatch,
+          },
+        'registry': self.registry_stats(),
+        'resync':   self.resync_progress(),
+        'waits':    self.wait_stats(),
+        'coalesce': self.coalesce_stats(),
+        })
+    return snapshot
+
+  def wait_stats(self):
+    """Return a dict describing how long callers have spent blocked waiting
+    for zookeeper to fill in node values and children: the number of waits
+    that blocked, how many of those timed out, and the total and longest time
+    spent blocked, in seconds.
+    """
+    return WAIT_STATS.snapshot()
+
+  def registry_stats(self):
+    """Return a dict with the number of mirrored nodes, the configured cap on
+    that number (None if unbounded), how many nodes have been evicted to stay
+    under it, and how many of the nodes watch their values and children.
+    """
+    with self.__nodelck:
+      modes = [node._watching() for node in self.__nodes.values()]
+    return {
+        'nodes':          len(modes),
+        'max_nodes':      self.__maxnode,
+        'evictions':      self.__evicted,
+        'value_watches':  sum(1 for mode in modes if mode & WATCH_VALUE),
+        'child_watches':  sum(1 for mode in modes if mode & WATCH_CHILDREN),
+        }
+
+  def save_snapshot(self, filename):
+    """Write everything the mirror knows about its nodes (values, stats and
+    children) to filename, for a later load_snapshot to warm up from. Returns
+    the number of nodes written.
+    """
+    with self.__nodelck:
+      nodes = list(self.__nodes.values())
+    return snapshot.save(filename,
+        (entry for entry in (node._snapshot() for node in nodes)
+          if entry is not None))
+
+  def load_snapshot(self, filename):
+    """Mirror every node stored in a snapshot written by save_snapshot, serving
+    reads from the snapshot until zookeeper has been heard from (nodes report
+    is_stale() in the meantime). Nodes are revalidated against zookeeper as
+    usual, and watchers only fire for entries that turn out to have changed.
+    This can be called before connect. Returns the number of nodes loaded.
     """
-    return not self.__disconnected
+    entries = snapshot.load(filename)
+    for entry in entries:
+      self.get(entry.path)._preload(entry)
+    return len(entries)
 
   @fix_path
-  def get(self, path):
-    try:
-      return self.__nodes[path]
-    except KeyError:
-      with self.__nodelck:
-        try:
-          node = self.__nodes[path]
-        except KeyError:
-          node = Node(path, self)
-          self.__nodes[path] = node
-          self._setup(node)
+  def get(self, path, watch=None):
+    """Get the node mirroring path. watch says what the node keeps watches
+    on: WATCH_VALUE, WATCH_CHILDREN, WATCH_BOTH, or WATCH_NONE for a node
+    that reads from zookeeper on every call. Leaves that nobody lists only
+    need WATCH_VALUE, which halves their watches. If the node is already
+    mirrored, it goes on watching what it did, plus anything new in watch;
+    left as None, watch keeps an existing node's mode, and gives new nodes
+    WATCH_BOTH.
+    """
+    if self.__maxnode is None:
+      try:
+        node = self.__nodes[path]
+      except KeyError:
+        pass
+      else:
+        if watch is not None and watch & ~node._watching():
+          node._upgrade(watch)
         return node
+    with self.__nodelck:
+      try:
+        node = self.__nodes[path]
+        if path in self.__lru:
+          self.__lru[path] = (self.__lru.pop(path)[0], time.time())
+      except KeyError:
+        node = Node(path, self, WATCH_BOTH if watch is None else watch)
+        self.__nodes[path] = node
+        self.__index[path] = node
+        self.__lru[path]   = (node, time.time())
+        self._setup(node)
+        self._evict(node)
+        return node
+    if watch is not None and watch & ~node._watching():
+      node._upgrade(watch)
+    return node
+
+  @fix_path
+  def get_tree(self, path, depth=None):
+    """Get the node at path, and mirror every node below it as well. Children
+    are set up as zookeeper lists them, so the whole subtree is loaded
+    without waiting on each level in turn, and nodes that vanish from their
+    parent's children are released. If depth is given, only that many levels
+    below path are mirrored.
+
+    Nodes whose children belong to the tree watch both their values and
+    their children, whatever mode they were mirrored with before; nodes at
+    the depth limit only need to watch their values.
+    """
+    with self.__nodelck:
+      grown = True
+      if path in self.__trees:
+        old = self.__trees[path]
+        if old is None or (depth is not None and depth <= old):
+          depth = old
+          grown = False
+      self.__trees[path] = depth
+    node = self._tree_node(path)
+    if not grown:
+      self._expand_tree(path, None, node._immed_raw_children())
+      return node
+    # Nodes mirrored already, by an earlier, shallower get_tree or otherwise,
+    # won't list their children again by themselves
+    for each in self.walk(path):
+      if self._in_tree(each.path):
+        each = self._tree_node(each.path)
+        self._expand_tree(each.path, None, each._immed_raw_children())
+    return node
 
   def get_json(self, path):
     return JsNode(self.get(path))
 
+  def get_many(self, paths, timeout=5, codec=None, watch=None):
+    """Read the values of many nodes at once. Every node's request is sent
+    before any answer is waited on, and all of them share one timeout.
+    Returns a dict mapping each of the given paths to its (value, meta) pair,
+    decoded with codec if one is given, or to the exception reading it
+    failed with: NoNodeException for nodes that don't exist, and
+    OperationTimeoutException for those zookeeper didn't answer in time.
+    Nodes not yet mirrored are set up with the given watch mode (see get).
+    """
+    return self._gather(paths, timeout, watch,
+        lambda node: node.avalue(codec), WATCH_VALUE, self._aget)
+
+  def children_many(self, paths, timeout=5, watch=None):
+    """Like get_many, but for the children of each path.
+    """
+    return self._gather(paths, timeout, watch,
+        lambda node: node.achildren(), WATCH_CHILDREN, self._aget_children)
+
+  def _gather(self, paths, timeout, watch, start, part, refetch):
+    """Start a read on the node at each path with start, and collect the
+    outcomes by path. Halfway through the timeout, refetch is called for the
+    paths still unanswered whose nodes watch part, the way Node.value asks
+    again; unwatched reads are one-shot, and have nothing to ask again for.
+    """
+    deadline = time.time() + timeout
+    halfway  = time.time() + timeout / 2.0
+    futures  = [(path, self.get(path, watch)) for path in paths]
+    futures  = [(path, node, start(node)) for path, node in futures]
+    results  = {}
+    for path, node, future in futures:
+      try:
+        future.exception(max(0, halfway - time.time()))
+      except OperationTimeoutException:
+        if node._watching() & part and self.is_connected(node.path):
+          refetch(node.path)
+    for path, node, future in futures:
+      try:
+        results[path] = future.result(max(0, deadline - time.time()))
+      except OperationTimeoutException as exc:
+        # Don't leave the read waiting on the node for an answer nobody
+        # will pick up
+        future._abandon()
+        results[path] = exc
+      except Exception as exc:
+        results[path] = exc
+    return results
+
+  def find(self, prefix):
+    """List the mirrored nodes whose paths start with the string prefix, and
+    those below them, parents first. find('/jobs/item-') finds
+    /jobs/item-0000000001 and /jobs/item-0000000001/result, but not /jobs.
+    """
+    with self.__nodelck:
+      return [node for _path, node in self.__index.find(prefix)]
+
+  @fix_path
+  def walk(self, path):
+    """List the mirrored nodes at and below path, parents first.
+    """
+    with self.__nodelck:
+      return [node for _path, node in self.__index.walk(path)]
+
+  @fix_path
+  def mirrored_ancestor(self, path):
+    """Return the nearest mirrored node above path, or None if there is none.
+    """
+    with self.__nodelck:
+      found = self.__index.nearest(path)
+    return found and found[1]
+
+  @fix_path
+  def get_large(self, path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Get a ChunkedNode for path, which stores values too large for a single
+    znode by splitting them into compressed child chunks.
+    """
+    return ChunkedNode(self, path, chunk_size)
+
+  def get_codec(self, path, codec):
+    """Get the node at path, wrapped so that its values go through codec (see
+    zkmirror.codec).
+    """
+    return CodecNode(self.get(path), codec)
+
   @fix_path
   def create(self, path, value='', flags=0):
     if not flags:
       node = self.get(path)
       node.create(value)
       return node
-    path = self._use_socket(lambda z:
+    path = self._write('create', path, lambda z:
         zookeeper.create(z, path, value, ALL_ACL, flags))
-    return self.get(path)
+    node = self.get(path)
+    node._created(value)
+    return node
 
   @fix_path
-  def create_r(self, path, value=''):
+  def acreate(self, path, value='', flags=0):
+    """Asynchronous version of create. Returns a Future whose result is the
+    Node for the created path.
+    """
+    return self._acreate(path, value, flags)._then(self.get)
+
+  @fix_path
+  def create_r(self, path, value='', timeout=5):
     """Create the entire path up to this node, and then create this node"""
-    pre = path.rsplit('/',1)[0]
-    if pre:
-      self.ensure_exists(pre)
-    self.create(path, value)
+    parents = self._materialize(dict.fromkeys(ancestors(path), ''), path)
+    created = self._acreate(path, value, via=path)
+    deadline = time.time() + timeout
+    self._await_materialized(parents, deadline)
+    created.result(max(0, deadline - time.time()))
+    node = self.get(path)
+    node._created(value)
+    return node
 
   def create_json(self, path, value, flags=0):
     return JsNode(self.create(path, json.dumps(value), flags))
@@ -143,27 +433,69 @@ class Mirror(object):
   def ensure_exists(self, path, value=''):
     """Make sure every node, up to the given path, exists in zookeeper.
     """
-    node = self.get(path)
+    self.ensure_paths([path], value)
+    return self.get(path)
+
+  def ensure_paths(self, paths, value='', timeout=5):
+    """Make sure every one of the given paths exists in zookeeper, along with
+    all of their ancestors. Every missing node is created in one pipelined
+    batch, parents ahead of their children, so this costs about one round
+    trip no matter how many paths or levels are involved. Missing paths from
+    the list are created with the given value, and missing ancestors are
+    created empty. Nodes that turn out to exist already are left alone.
+    """
+    wanted = {}
+    paths  = [normalize(path) for path in paths]
+    for path in paths:
+      for ancestor in ancestors(path):
+        wanted.setdefault(ancestor, '')
+    for path in paths:
+      if path != '/':
+        wanted[path] = value
+
+    deadline = time.time() + timeout
+    via      = paths[0] if paths else '/'
+    self._await_materialized(self._materialize(wanted, via), deadline)
+
+  def _materialize(self, wanted, via):
+    """Send creates for each path in the wanted dict that isn't known to
+    exist, parents ahead of their children, using the values from wanted.
+    Zookeeper handles a session's requests in order, so with all of them sent
+    through the session serving via, the parents are in place by the time
+    each child's create is processed.
+    """
+    return [self._acreate(path, wanted[path], via=via)
+        for path in sorted(wanted, key=lambda path: path.count('/'))
+        if not self._known_to_exist(path)]
+
+  def _await_materialized(self, futures, deadline):
+    """Wait on the create futures from a materialization; NodeExistsException
+    counts as success. The first real failure is raised once every future has
+    completed.
+    """
+    failure = None
+    for future in futures:
+      exc = future.exception(max(0, deadline - time.time()))
+      if exc is not None and not isinstance(exc, NodeExistsException):
+        failure = failure or exc
+    if failure is not None:
+      raise failure
+
+  def _known_to_exist(self, path):
     try:
-      node.value(timeout=0.1)
-    except NoNodeException:
-      try:
-        node.create(value)
-      except NodeExistsException:
-        # No problem; it exists
-        pass
-      except NoNodeException:
-        # the parent doesn't exist
-        self.ensure_exists(path.rsplit('/',1)[0])
-        self.ensure_exists(path)
-    return node
+      return self.__nodes[path]._immed_raw_value() is not None
+    except KeyError:
+      return path == '/'
 
-  def addStateWatcher(self, key, fn):
+  def addStateWatcher(self, key, fn, path=None):
     """Add a function that will be called when our connection state changes.
     This function will be called with a zookeeper state variable (an int with
     one of the values of
     zookeeper.{AUTH_FAILED,EXPIRED_SESSION,CONNECTING,ASSOCIATING,CONNECTED}_STATE
     of the value 0 (shouldn't happen, but it does)
+
+    If path is given, fn only hears about the session serving path;
+    otherwise it hears about every session.
     """
     def catcher(val):
       try:
@@ -171,7 +503,7 @@ class Mirror(object):
       except:
         print 'state watcher callback threw this:'
         traceback.print_exc()
-    self.__state_cbs[key] = catcher
+    self.__state_cbs[key] = (catcher, path)
 
   def delStateWatcher(self, key):
     """Remove the state watcher that was assigned at the given key.
@@ -188,7 +520,41 @@ class Mirror(object):
     """
     return ChrootMirror(path, self)
 
-  def _run_async(self, fn):
+  def resync_progress(self):
+    """Return the progress of the latest post-expiry resync: total nodes,
+    nodes done, nodes in flight, whether it's still running, and how long it
+    has taken so far.
+    """
+    progress = {'total': 0, 'done': 0, 'inflight': 0, 'running': False,
+        'elapsed': 0.0}
+    for session in self.__sessions:
+      if session.resync is not None:
+        progress = _combine(progress, session.resync.progress())
+    return progress
+
+  def pending_stats(self):
+    """Return the depth, limit, and merged and dropped counts of the queue of
+    requests waiting for a reconnection; see PendingQueue.stats. With several
+    sessions, the figures are summed across them.
+    """
+    stats = self.__sessions[0].pending.stats()
+    for session in self.__sessions[1:]:
+      stats = _combine(stats, session.pending.stats())
+    return stats
+
+  def dispatch_stats(self):
+    """Return the callback dispatcher's per-worker queue depth and lag figures;
+    see Dispatcher.stats.
+    """
+    return self.__async.stats()
+
+  def coalesce_stats(self):
+    """Return a dict with the number of updates handed to coalescing watchers,
+    and how many of those were replaced by newer updates before delivery.
+    """
+    return COALESCE_STATS.snapshot()
+
+  def _run_async(self, fn, key=None):
     """Functions that wait on results from zookeeper cannot be usefully called
     from within zookeeper callbacks, as the zookeeper receive socket is
     blocked until the callback returns. Any callback that waits on zookeeper
@@ -196,10 +562,37 @@ class Mirror(object):
     but the equivalent zookeeper.acreate, etc calls do not wait) should
     instead hand a thunk to this, so that the work can be done outside of the
     zookeeper callback.
+
+    Thunks that share a key (callbacks for a given node are keyed by its
+    path) are run in the order in which they were handed over.
     """
-    self.__q.put(fn)
+    self.__async.submit(key, fn)
+
+  def _session(self, path):
+    """The session that serves path.
+    """
+    sessions = self.__sessions
+    if len(sessions) == 1:
+      return sessions[0]
+    return sessions[(zlib.crc32(path) & 0xffffffff) % len(sessions)]
+
+  def _session_of(self, zk):
+    """The session using handle zk, or None if it's an old handle.
+    """
+    for session in self.__sessions:
+      # Taking the lock waits out a _reconnect that is assigning the handle
+      with session.lock:
+        if session.handle == zk:
+          return session
+    return None
 
   def _events(self, zk, event, state, path):
+    self.__stats.incr('event.' + describe_event(event))
+    if event != SESSION_EVENT and path not in self.__nodes:
+      # An evicted or released node's last watch firing; let it lapse
+      del_missing(self.__misslck, self.__missing, path)
+      return
+
     if event == CHANGED_EVENT:
       debug('_events: adding CHANGE watcher for', path)
       self._aget(path)
@@ -207,10 +600,13 @@ class Mirror(object):
       debug('_events: adding CHILDREN watcher for', path)
       self._aget_children(path)
     elif event == CREATED_EVENT:
-      debug('_events: adding CHANGE and CHILDREN watchers for', path)
+      debug('_events: adding watchers for', path)
       del_missing(self.__misslck, self.__missing, path)
-      self._aget(path)
-      self._aget_children(path)
+      try:
+        node = self.__nodes[path]
+        self._fetch(node, node._watching())
+      except KeyError:
+        pass
     elif event == DELETED_EVENT:
       try:
         node = self.__nodes[path]
@@ -220,55 +616,106 @@ class Mirror(object):
       except KeyError:
         pass
     elif event == SESSION_EVENT:
-      if zk != self.__zk:
+      session = self._session_of(zk)
+      if session is None:
         return
+      self.__stats.incr('session.' + describe_state(state))
 
-      for fn in self.__state_cbs.values():
-        self._run_async(lambda: fn(state))
+      for fn, watched in self.__state_cbs.values():
+        if watched is None or self._session(watched) is session:
+          self._run_async(lambda fn=fn: fn(state))
 
       if state == CONNECTED_STATE:
-        self.__disconnected = None
-      elif self.__disconnected is None:
-        self.__disconnected = time.time()
+        session.disconnected = None
+      elif session.disconnected is None:
+        session.disconnected = time.time()
 
       if state == EXPIRED_SESSION_STATE:
-        self._reconnect()
+        # Record the expiry before reconnecting; the new session's CONNECTED
+        # event may be handled before _reconnect even returns
+        session.state = state
+        debug('_events: My state is now', describe_state(session.state))
+        self._reconnect(session)
+        return
       elif state == CONNECTED_STATE:
-        if self.__state == EXPIRED_SESSION_STATE:
+        if session.state == EXPIRED_SESSION_STATE:
           # We just reconnected from a totally dead connection, so we need to
-          # setup everything again
-          for node in self.__nodes.values():
-            self._setup(node)
+          # setup everything again. That covers anything that was pending.
+          session.pending.drain()
+          self._resync(session)
         else:
           # Happy reconnection; just do the pending stuff
-          while self.__pending:
-            self.__pending.pop()()
+          actions, overflowed = session.pending.drain()
+          if overflowed:
+            # Some retries were dropped, so we don't know what's stale
+            self._resync(session)
+          else:
+            for action in actions:
+              action()
+
+      session.state = state
+      debug('_events: My state is now', describe_state(session.state))
 
-      self.__state = state
-      debug('_events: My state is now', describe_state(self.__state))
+  def _resync(self, session):
+    if session.resync is not None:
+      session.resync.cancel()
+    with self.__nodelck:
+      nodes = [node for node in self.__nodes.values()
+          if self._session(node.path) is session]
+    session.resync = Resync(self._setup, nodes, self.__maxresync)
+    session.resync.start()
 
-  def _reconnect(self):
-    oldzk        = self.__zk
-    self.__zk    = zookeeper.init(self.__initstr, self._events)
+  def _reconnect(self, session):
+    if session.resync is not None:
+      # Its outstanding requests died with the old session
+      session.resync.cancel()
+    # The new handle's first session event can arrive before init returns;
+    # holding the session's lock makes _events wait until it is assigned
+    with session.lock:
+      oldzk          = session.handle
+      session.handle = zookeeper.init(self.__initstr, self._events)
     if oldzk >= 0:
       zookeeper.close(oldzk)
 
-  def _setup(self, node):
+  def _setup(self, node, done=None):
+    """Fetch whichever of node's value and children it watches, setting
+    watches on them. If done is given, it is called as each of the two
+    requests is answered, or skipped.
+    """
+    debug('_setup: adding watchers for', node.path)
+    self._fetch(node, node._watching(), done)
+
+  def _fetch(self, node, watch, done=None):
+    """Fetch the value and/or children of node, as the WATCH_ flags in watch
+    say, setting watches on them. done works as it does for _setup.
+    """
     path = node.path
-    debug('_setup: adding CHANGE and CHILDREN watchers for', path)
-    self._aget(path)
-    self._aget_children(path)
+    if watch & WATCH_VALUE:
+      self._aget(path, done)
+    elif done is not None:
+      done()
+    if watch & WATCH_CHILDREN:
+      self._aget_children(path, done)
+    elif done is not None:
+      done()
 
-  def _aget(self, path):
+  def _aget(self, path, done=None):
     self._try_zoo(
-        lambda: self._use_socket(
-          lambda z: zookeeper.aget(z, path, self._events, self._get_cb(path))))
+        ('get', path),
+        lambda: self._use_socket(path,
+          lambda z: zookeeper.aget(z, path, self._events,
+            self._get_cb(path, done))),
+        lambda: self._aget(path),
+        done)
 
-  def _aget_children(self, path):
+  def _aget_children(self, path, done=None):
     self._try_zoo(
-        lambda: self._use_socket(
+        ('children', path),
+        lambda: self._use_socket(path,
           lambda z: zookeeper.aget_children(z, path, self._events,
-            self._ls_cb(path))))
+            self._ls_cb(path, done))),
+        lambda: self._aget_children(path),
+        done)
 
   def _aexists(self, path):
     if add_missing(self.__misslck, self.__missing, path):
@@ -279,44 +726,315 @@ class Mirror(object):
       watcher = None
 
     self._try_zoo(
-        lambda: self._use_socket(
+        ('exists', path),
+        lambda: self._use_socket(path,
           lambda z: zookeeper.aexists(z, path, watcher, self._exist_cb(path))))
 
-  def _try_zoo(self, action):
+  def _aread(self, path, via=None):
+    """Read path once, without mirroring it or leaving a watch behind.
+    Returns a Future whose result is the (value, Meta) pair.
+    """
+    future = Future()
+    start  = time.time()
+    def cb(_zk, status, value, meta):
+      self.__stats.record('aread', time.time() - start)
+      if status == OK:
+        future._set_result((value, Meta(meta)))
+      else:
+        future._set_exception(error_for(status))
+    self._start_request(via or path, future, lambda z:
+        zookeeper.aget(z, path, None, cb))
+    return future
+
+  def _aread_children(self, path, via=None):
+    """List path's children once, without mirroring it or leaving a watch
+    behind. Returns a Future whose result is the list of children.
+    """
+    future = Future()
+    start  = time.time()
+    def cb(_zk, status, children):
+      self.__stats.record('aread_children', time.time() - start)
+      if status == OK:
+        future._set_result(children)
+      else:
+        future._set_exception(error_for(status))
+    self._start_request(via or path, future, lambda z:
+        zookeeper.aget_children(z, path, None, cb))
+    return future
+
+  def _await_gone(self, path, via=None):
+    """Returns a Future whose result is None once path doesn't exist. This
+    leaves a one-shot exists watch on path alone, so only its deletion wakes
+    us, rather than every change to the directory it is in. The Future fails
+    with SessionExpiredException if the session ends first.
+    """
+    future = Future()
+    start  = time.time()
+    def watcher(_zk, event, state, _path):
+      if event == DELETED_EVENT:
+        future._set_result(None)
+      elif event == SESSION_EVENT:
+        if state == EXPIRED_SESSION_STATE:
+          future._set_exception(SessionExpiredException())
+      else:
+        # Changed, or re-created; whatever it was, look again
+        arm()
+    def cb(_zk, status, meta):
+      self.__stats.record('aexists', time.time() - start)
+      if status == NONODE:
+        future._set_result(None)
+      elif status != OK:
+        future._set_exception(error_for(status))
+    def arm():
+      self._start_request(via or path, future, lambda z:
+          zookeeper.aexists(z, path, watcher, cb))
+    arm()
+    return future
+
+  def _acreate(self, path, value, flags=0, via=None):
+    """Send a create request without waiting for it. Returns a Future whose
+    result is the path that was created.
+    """
+    future = Future()
+    start  = time.time()
+    def cb(_zk, status, created):
+      self.__stats.record('acreate', time.time() - start)
+      if status == OK:
+        node = self.__nodes.get(created)
+        if node is not None:
+          node._created(value)
+        future._set_result(created)
+      else:
+        future._set_exception(error_for(status))
+    self._start_request(via or path, future, lambda z:
+        zookeeper.acreate(z, path, value, ALL_ACL, flags, cb))
+    return future
+
+  def _aset(self, path, value, version, via=None):
+    """Send a set request without waiting for it. Returns a Future whose
+    result is the node's new stat dict; the written value is applied to the
+    mirrored node (if there is one) as soon as the server confirms it.
+    """
+    future = Future()
+    start  = time.time()
+    def cb(_zk, status, stat):
+      self.__stats.record('aset', time.time() - start)
+      if status == OK:
+        node = self.__nodes.get(path)
+        if node is not None:
+          node._val(value, stat)
+        future._set_result(stat)
+      else:
+        future._set_exception(error_for(status))
+    self._start_request(via or path, future, lambda z:
+        zookeeper.aset(z, path, value, version, cb))
+    return future
+
+  def _adelete(self, path, version, via=None):
+    """Send a delete request without waiting for it. Returns a Future whose
+    result is None; the mirrored node (if there is one) is marked deleted as
+    soon as the server confirms it.
+    """
+    future = Future()
+    start  = time.time()
+    def cb(_zk, status):
+      self.__stats.record('adelete', time.time() - start)
+      if status == OK:
+        node = self.__nodes.get(path)
+        if node is not None:
+          node._delete()
+        future._set_result(None)
+      else:
+        future._set_exception(error_for(status))
+    self._start_request(via or path, future, lambda z:
+        zookeeper.adelete(z, path, version, cb))
+    return future
+
+  def _start_request(self, via, future, action):
+    """Send a request with action, through the session serving the path via;
+    if zookeeper refuses it outright, fail future. The request helpers take
+    an optional via to use in place of the path they act on, since requests
+    are only applied in the order they were sent when they share a session:
+    a batch of creates, or a write and the reads that must see it, should
+    pass the same via.
+    """
+    try:
+      self._use_socket(via, action)
+    except (SystemError, ZooKeeperException) as exc:
+      future._set_exception(exc)
+
+  def _try_zoo(self, key, action, retry=None, done=None):
+    """Run action; if zookeeper refuses it outright, queue retry (or action
+    itself) under key to be run once we reconnect, and call done, since no
+    answer will be coming.
+    """
     try:
       action()
     except (SystemError, ZooKeeperException):
-      # self.__zk must be really broken; we'll throw this in pending until we
-      # get a new connection
-      self.__pending.append(action)
+      # The session must be really broken; we'll throw this in pending until
+      # we get a new connection. key is (operation, path)
+      self._session(key[1]).pending.add(key, retry or action)
+      if done is not None:
+        done()
 
-  def _get_cb(self, path):
+  def _get_cb(self, path, done=None):
+    start = time.time()
     def cb(_zk, status, value, meta):
+      self.__stats.record('aget', time.time() - start)
       self._update_node(
           path,
           status,
           lambda node: node._val(value, meta),
+          ('get', path),
           lambda: self._aget(path))
+      if done is not None:
+        done()
     return cb
 
-  def _ls_cb(self, path):
+  def _ls_cb(self, path, done=None):
+    start = time.time()
     def cb(_zk, status, children):
+      self.__stats.record('aget_children', time.time() - start)
       self._update_node(
           path,
           status,
-          lambda node: node._children(children),
+          lambda node: self._update_children(node, children),
+          ('children', path),
           lambda: self._aget_children(path))
+      if done is not None:
+        done()
     return cb
 
+  def _update_children(self, node, children):
+    old = node._immed_raw_children()
+    node._children(children)
+    self._expand_tree(node.path, old, children)
+
+  def _expand_tree(self, path, old, children):
+    """If path is inside a mirrored subtree, set up nodes for the children that
+    have appeared since old was listed, and release the ones that have gone.
+    """
+    if children is None or not self._in_tree(path):
+      return
+    path    = Path(path)
+    old     = set(old or ())
+    current = set(children)
+    for name in current - old:
+      self._tree_node(path.child(name))
+    for name in old - current:
+      self._release(path.child(name))
+
+  def _tree_node(self, path):
+    """Get the node at path, which is in a mirrored subtree, watching what
+    the tree needs of it.
+    """
+    if self._in_tree(path):
+      return self.get(path, WATCH_BOTH)
+    return self.get(path, WATCH_VALUE)
+
+  def _in_tree(self, path):
+    """Whether the children of path belong to a mirrored subtree.
+    """
+    if not self.__trees:
+      return False
+    levels = 0
+    while True:
+      try:
+        depth = self.__trees[path]
+        if depth is None or levels < depth:
+          return True
+      except KeyError:
+        pass
+      if path == '/':
+        return False
+      path    = Path(path).parent
+      levels += 1
+
+  def _release(self, path):
+    """Stop mirroring path and everything mirrored below it, except for nodes
+    that somebody has attached watchers to.
+    """
+    with self.__nodelck:
+      for other, node in self.__index.walk(path):
+        if not node._watched():
+          del self.__nodes[other]
+          self.__index.pop(other)
+          self.__lru.pop(other, None)
+          node._evict()
+          del_missing(self.__misslck, self.__missing, other)
+
+  def _evict(self, spare=None):
+    """Drop least recently used nodes until we're back under max_nodes. A
+    node counts as used when it's fetched with get, and when it's read, which
+    is only noticed once it reaches the front of the line: it then goes to
+    the back instead of being evicted. Nodes with watchers can't be evicted;
+    they leave the line until their last watcher is removed. spare is a node
+    that's being handed out, and mustn't be evicted before its caller gets a
+    chance to use it. Must be called with __nodelck held.
+    """
+    if self.__maxnode is None:
+      return
+    for _ in range(2 * len(self.__lru)):
+      if len(self.__nodes) <= self.__maxnode or not self.__lru:
+        return
+      path, (node, queued) = self.__lru.popitem(last=False)
+      if node._watched():
+        continue
+      if node is spare:
+        # Everything queued ahead of it is gone or can't be evicted
+        self.__lru[path] = (node, queued)
+        return
+      read = node._last_read()
+      if read > queued:
+        self.__lru[path] = (node, read)
+        continue
+      del self.__nodes[path]
+      self.__index.pop(path)
+      node._evict()
+      self.__evicted += 1
+
+  def _unwatched(self, node):
+    """Called by nodes when their last watcher is removed, so that they can
+    be evicted again.
+    """
+    if self.__maxnode is None:
+      return
+    with self.__nodelck:
+      if self.__nodes.get(node.path) is node and node.path not in self.__lru:
+        self.__lru[node.path] = (node, time.time())
+        self._evict()
+
+  def _adopt(self, node):
+    """Called by evicted nodes when they are read, and by nodes that get
+    watchers. Puts node back into the mirror if nothing else has taken its
+    path since, and returns whichever node is now mirroring the path.
+    """
+    with self.__nodelck:
+      current = self.__nodes.get(node.path)
+      if current is not None:
+        return current
+      node._adopted()
+      self.__nodes[node.path] = node
+      self.__index[node.path] = node
+      self.__lru[node.path]   = (node, time.time())
+      self._setup(node)
+      self._evict(node)
+      return node
+
   def _exist_cb(self, path):
+    start = time.time()
     def cb(_zk, status, meta):
+      self.__stats.record('aexists', time.time() - start)
       if status == OK:
         # It started existing while our message was in transit; set up the
         # node's data and allow watch callbacks to occur on future aexist
         # calls
         del_missing(self.__misslck, self.__missing, path)
-        self._aget(path)
-        self._aget_children(path)
+        try:
+          node = self.__nodes[path]
+          self._fetch(node, node._watching())
+        except KeyError:
+          pass
       elif status == NONODE:
         # This is what we expect; our watcher is set up, so we're happy
         pass
@@ -326,9 +1044,10 @@ class Mirror(object):
         # from __missing so that a future aexists call can put the watcher
         # back on
         del_missing(self.__misslck, self.__missing, path)
-        self.__pending.append(lambda: self._aexists(path))
+        self._session(path).pending.add(('exists', path),
+            lambda: self._aexists(path))
 
-  def _update_node(self, path, status, node_action, on_servfail):
+  def _update_node(self, path, status, node_action, retry_key, on_servfail):
     try:
       node = self.__nodes[path]
     except KeyError:
@@ -346,43 +1065,40 @@ class Mirror(object):
     else:
       # Something (I assume connection-related) made the request fail. We'll
       # try again once we reconnect
-      self.__pending.append(on_servfail)
+      self._session(path).pending.add(retry_key, on_servfail)
+
+  def _use_socket(self, path, action):
+    return self._session(path).use(action)
 
-  def _use_socket(self, action):
-    with self.__socklck:
-      return action(self.__zk)
+  def _write(self, op, path, action):
+    """Run a synchronous write to path through _use_socket, recording how
+    long it took (and whether it failed) under op.
+    """
+    start = time.time()
+    try:
+      return self._use_socket(path, action)
+    except Exception:
+      self.__stats.incr(op + '.failed')
+      raise
+    finally:
+      self.__stats.record(op, time.time() - start)
 
   def close(self):
-    def quit_async():
-      sys.exit(0)
-    self._run_async(quit_async)
-    print 'killed async thread'
-    self.__async.join()
-    print 'async thread done'
-    if self.__zk >= 0:
-      zookeeper.close(self.__zk)
-      self.__zk = -1
-      try:
-        del self.__initstr
-      except AttributeError:
-        pass
+    self.__async.close()
+    print 'async threads done'
+    for session in self.__sessions:
+      if session.handle >= 0:
+        zookeeper.close(session.handle)
+        session.handle = -1
+    try:
+      del self.__initstr
+    except AttributeError:
+      pass
     print 'zookeeper closed'
 
   def __del__(self):
     self.close()
 
-def run_tasks(queue):
-  try:
-    while True:
-      function = queue.get()
-      try:
-        function()
-      except Exception:
-        print 'zkmirror asynchronous task failed like this:'
-        traceback.print_exc()
-  finally:
-    print 'run_tasks thread shutting down'
-
 def add_missing(lock, missing, path):
   with lock:
     if path in missing:
@@ -397,3 +1113,20 @@ def del_missing(lock, missing, path):
     except KeyError:
       pass
 
+
+def _combine(mine, theirs):
+  """Merge two sessions' figures: numbers add up, flags are or-ed, and
+  elapsed times take the longer.
+  """
+  combined = {}
+  for key, val in mine.items():
+    other = theirs.get(key)
+    if key == 'elapsed':
+      combined[key] = max(val, other)
+    elif isinstance(val, bool):
+      combined[key] = val or other
+    elif val is None or other is None:
+      combined[key] = None
+    else:
+      combined[key] = val + other
+  return combined
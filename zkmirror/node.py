@@ -2,21 +2,41 @@ from .zk import NodeExistsException
 from .zk import NoNodeException
 from .zk import fix_path
 from .zk import ALL_ACL
+from .zk import STAT_FIELDS
+from .snapshot import Entry
+from .future import Future
+from . import alarm
+from threading import Condition, Lock, RLock
+from operator import itemgetter
+from bisect import bisect_left
+from bisect import insort
 import traceback
 import zookeeper
 import time
 
-TINY_SLEEP=0.01
+_UNSET = object()
 
-class Meta(object):
-  def __init__(self, dct):
-    self.__ctime       = dct['ctime']
-    self.__aversion    = dct['aversion']
-    self.__numChildren = dct['numChildren']
-    self.__version     = dct['version']
-    self.__dataLength  = dct['dataLength']
-    self.__mtime       = dct['mtime']
-    self.__cversion    = dct['cversion']
+# What a node keeps watches on, for Mirror.get's watch argument. Nodes not
+# watching their value or children read them from zookeeper on every call.
+WATCH_NONE     = 0
+WATCH_VALUE    = 1
+WATCH_CHILDREN = 2
+WATCH_BOTH     = WATCH_VALUE | WATCH_CHILDREN
+
+class Meta(tuple):
+  """The stat zookeeper keeps for a node. This is a plain tuple of the stat
+  fields underneath, so it is cheap to build and to hold onto; the fields are
+  available by name as attributes.
+  """
+  __slots__ = ()
+
+  _fields = STAT_FIELDS
+
+  def __new__(cls, dct):
+    return tuple.__new__(cls, [dct.get(field, 0) for field in cls._fields])
+
+  def __getnewargs__(self):
+    return (self._asdict(),)
 
   def __repr__(self):
     return '\n'.join([
@@ -28,41 +48,229 @@ class Meta(object):
       '  numChild: %s' % self.numChildren,
       ])
 
-  @property
-  def ctime(self):
-    return self.__ctime
+  def _asdict(self):
+    return dict(zip(self._fields, self))
+
+  czxid          = property(itemgetter(0))
+  mzxid          = property(itemgetter(1))
+  ctime          = property(itemgetter(2))
+  mtime          = property(itemgetter(3))
+  version        = property(itemgetter(4))
+  cversion       = property(itemgetter(5))
+  aversion       = property(itemgetter(6))
+  ephemeralOwner = property(itemgetter(7))
+  dataLength     = property(itemgetter(8))
+  numChildren    = property(itemgetter(9))
+  pzxid          = property(itemgetter(10))
+
+class Data(object):
+  """A node's value along with its Meta, which holds the stat zookeeper sent
+  as a plain tuple; the stat dict itself isn't kept. Decodings of the value
+  are only made the first time somebody asks for them.
+  """
+  __slots__ = ('value', 'meta', '__decoded')
 
-  @property
-  def aversion(self):
-    return self.__aversion
-
-  @property
-  def numChildren(self):
-    return self.__numChildren
+  def __init__(self, value, stat):
+    self.value     = value
+    self.meta      = Meta(stat)
+    self.__decoded = None
 
   @property
   def version(self):
-    return self.__version
+    return self.meta.version
 
-  @property
-  def dataLength(self):
-    return self.__dataLength
+  def same_version(self, other):
+    """Whether other holds the same version of the same node as this. A zero
+    czxid means the creation zxid isn't known, and matches any.
+    """
+    if self.meta.version != other.meta.version:
+      return False
+    return self.same_node(other)
 
-  @property
-  def mtime(self):
-    return self.__mtime
+  def same_node(self, other):
+    mine   = self.meta.czxid
+    theirs = other.meta.czxid
+    return not mine or not theirs or mine == theirs
 
-  @property
-  def cversion(self):
-    return self.__cversion
+  def older_than(self, other):
+    """Whether this is an earlier version of the same node as other.
+    """
+    return self.version < other.version and self.same_node(other)
+
+  def pair(self):
+    return (self.value, self.meta)
+
+  def decoded(self, codec):
+    """Return (decoded value, meta), decoding the value with codec only the
+    first time it's asked for.
+    """
+    try:
+      return self.__decoded[codec]
+    except (TypeError, KeyError):
+      pass
+    pair = (codec.decode(self.value), self.meta)
+    if self.__decoded is None:
+      self.__decoded = {}
+    self.__decoded[codec] = pair
+    return pair
+
+  def inherit(self, other):
+    """Take over other's decodings, if other holds the same version of the
+    same value; its Meta can't be reused, since the stat can change (e.g. the
+    number of children) without the version changing.
+    """
+    if other.__decoded and self.same_version(other) \
+        and self.value == other.value:
+      self.__decoded = dict((codec, (decoded, self.meta))
+          for codec, (decoded, _meta) in other.__decoded.items())
+
+class WaitStats(object):
+  """Tracks how long callers have spent blocked waiting on Values to be
+  filled in by zookeeper. One of these is shared by every Value in the
+  process.
+  """
+  def __init__(self):
+    self.__lock     = Lock()
+    self.__waits    = 0
+    self.__timeouts = 0
+    self.__blocked  = 0.0
+    self.__longest  = 0.0
+
+  def record(self, blocked, timed_out):
+    with self.__lock:
+      self.__waits   += 1
+      self.__blocked += blocked
+      if blocked > self.__longest:
+        self.__longest = blocked
+      if timed_out:
+        self.__timeouts += 1
+
+  def snapshot(self):
+    """Return a dict describing every wait that actually had to block.
+    """
+    with self.__lock:
+      return {
+          'waits':    self.__waits,
+          'timeouts': self.__timeouts,
+          'blocked':  self.__blocked,
+          'longest':  self.__longest,
+          }
+
+WAIT_STATS = WaitStats()
+
+class CoalesceStats(object):
+  """Counts updates handed to coalescing watchers, and how many of those were
+  replaced by a newer update before they could be delivered.
+  """
+  def __init__(self):
+    self.__lock      = Lock()
+    self.__updates   = 0
+    self.__coalesced = 0
+
+  def record(self, coalesced):
+    with self.__lock:
+      self.__updates += 1
+      if coalesced:
+        self.__coalesced += 1
+
+  def snapshot(self):
+    with self.__lock:
+      return {
+          'updates':   self.__updates,
+          'coalesced': self.__coalesced,
+          }
+
+COALESCE_STATS = CoalesceStats()
+
+class Watcher(object):
+  """Wraps a watcher function; every update handed to it is queued up for
+  delivery, and exceptions thrown by the function are swallowed.
+  """
+  def __init__(self, desc, fn):
+    self.__desc = desc
+    self.__fn   = fn
+
+  def _notify(self, run_async, key, get_val):
+    """Queue the update get_val() to be delivered, through run_async, under
+    the given key.
+    """
+    run_async(lambda: self(get_val()), key)
+
+  def __call__(self, val):
+    try:
+      self.__fn(val)
+    except:
+      print self.__desc, "watcher callback threw this:"
+      traceback.print_exc()
+
+class _ValueFn(object):
+  """Value watchers are handed Data records (or None); this passes them on
+  to the watcher function as (value, meta) pairs, decoded with codec if
+  there is one.
+  """
+  __slots__ = ('fn', 'codec')
+
+  def __init__(self, fn, codec):
+    self.fn    = fn
+    self.codec = codec
+
+  def __call__(self, data):
+    if data is None:
+      self.fn(None)
+    elif self.codec is None:
+      self.fn(data.pair())
+    else:
+      self.fn(data.decoded(self.codec))
+
+class CoalescingWatcher(Watcher):
+  """A Watcher that holds at most one undelivered update. If a newer update
+  arrives before the previous one has been delivered, it takes the previous
+  one's place, so the function only ever sees the latest state.
+  """
+  def __init__(self, desc, fn):
+    Watcher.__init__(self, desc, fn)
+    self.__lock    = Lock()
+    self.__pending = _UNSET
+
+  def _notify(self, run_async, key, get_val):
+    with self.__lock:
+      queued         = self.__pending is not _UNSET
+      self.__pending = get_val
+    COALESCE_STATS.record(queued)
+    if not queued:
+      run_async(self._flush, key)
+
+  def _flush(self):
+    with self.__lock:
+      get_val, self.__pending = self.__pending, _UNSET
+    self(get_val())
+
+# Values share these conditions, picked by identity, instead of each holding
+# its own: most Values are never waited on, and a condition costs more memory
+# than the rest of the Value put together. Waiters on a shared condition can
+# be woken for each other's values, and just go back to waiting.
+_CONDITIONS = [Condition(Lock()) for _ in xrange(64)]
 
 class Value(object):
   """Values from zookeeper have three states: node is good and has data
   (either content or children, depending on what this Value represents),
   node is deleted, and zookeeper hasn't told us yet. This uses None as the
   "node is deleted" state, anything else as the "we know the value" state, and
-  if zookeeper hasn't told us yet, __val isn't set at all.
+  if zookeeper hasn't told us yet, __val is _UNSET.
+
+  Threads waiting on a Value block on a condition that _set notifies, so they
+  wake up as soon as zookeeper's answer arrives; their timeouts are kept by
+  zkmirror.alarm, since python 2's timed waits poll. The condition is one of
+  _CONDITIONS. Callers that can't block register a callback with _on_set
+  instead.
   """
+  __slots__ = ('__cond', '__val', '__waiters')
+
+  def __init__(self):
+    self.__cond    = _CONDITIONS[(id(self) >> 4) % len(_CONDITIONS)]
+    self.__val     = _UNSET
+    self.__waiters = None
+
   def get(self, timeout=5):
     """Read the value that zookeeper has stored for us. If the associated node
     is deleted, this will raise NoNodeException. If zookeeper doesn't tell us
@@ -71,81 +279,345 @@ class Value(object):
     """
     value = self._wait(timeout)
     if value is None:
-      time.sleep(0.1)
-      value = self._wait(0)
-      if value is None:
+      # The node may be in the middle of being re-created; give it a moment
+      try:
+        value = self._wait_for(lambda val: val is not None, 0.1)
+      except zookeeper.OperationTimeoutException:
         raise zookeeper.NoNodeException
     return value
 
   def _wait(self, timeout=5):
-    try:
-      return self.__val
-    except AttributeError:
-      pass
+    return self._wait_for(None, timeout)
+
+  def _wait_for(self, ready, timeout=5):
+    """Wait until this has a value that satisfies ready (any value at all, if
+    ready is None), and return that value. Raises OperationTimeoutException
+    if that doesn't happen within timeout seconds.
+    """
+    val = self.__val
+    if val is not _UNSET and (ready is None or ready(val)):
+      return val
+    if timeout <= 0:
+      # Just a peek; nobody blocked
+      raise zookeeper.OperationTimeoutException
 
     start = time.time()
     end   = start + timeout
-    # Busy loop for a second
-    while time.time() < min(start+1, end):
-      try:
-        return self.__val
-      except AttributeError:
-        time.sleep(TINY_SLEEP)
+    with self.__cond:
+      while True:
+        val = self.__val
+        if val is not _UNSET and (ready is None or ready(val)):
+          WAIT_STATS.record(time.time() - start, False)
+          return val
+        remaining = end - time.time()
+        if remaining <= 0:
+          WAIT_STATS.record(time.time() - start, True)
+          raise zookeeper.OperationTimeoutException
+        alarm.wait(self.__cond, remaining)
+
+  def _on_set(self, fn, fail=None):
+    """Call fn with the value as soon as there is one; right away, if there
+    already is. If what we know is cleared first, fail is called instead, if
+    it's given.
+    """
+    with self.__cond:
+      val = self.__val
+      if val is _UNSET:
+        if self.__waiters is None:
+          self.__waiters = []
+        self.__waiters.append((fn, fail))
+        return
+    fn(val)
+
+  def _off_set(self, fn):
+    """Forget fn, which was given to _on_set, if it hasn't been called yet.
+    """
+    with self.__cond:
+      if not self.__waiters:
+        return
+      self.__waiters = [waiter for waiter in self.__waiters
+          if waiter[0] is not fn] or None
 
-    while time.time() < end:
+  def _set(self, value):
+    with self.__cond:
+      self.__val = value
+      self.__cond.notify_all()
+      waiters, self.__waiters = self.__waiters, None
+    self._wake(waiters, value)
+
+  def _peek(self):
+    """Return whatever we have right now, which is _UNSET if zookeeper hasn't
+    told us anything yet.
+    """
+    return self.__val
+
+  def _set_if_unset(self, value):
+    """Store value only if zookeeper hasn't told us anything yet. Returns
+    whether value was stored.
+    """
+    with self.__cond:
+      if self.__val is not _UNSET:
+        return False
+      self.__val = value
+      self.__cond.notify_all()
+      waiters, self.__waiters = self.__waiters, None
+    self._wake(waiters, value)
+    return True
+
+  def _wake(self, waiters, value):
+    for fn, _fail in waiters or ():
       try:
-        return self.__val
-      except AttributeError:
-        time.sleep(0.1)
+        fn(value)
+      except:
+        print "value callback threw this:"
+        traceback.print_exc()
+
+  def _clear(self):
+    """Forget whatever zookeeper told us; waiters will block until it tells
+    us again. Callbacks waiting on the value are dropped, since nothing may
+    ever tell us again, and the fail functions they were registered with are
+    returned, for the caller to call.
+    """
+    with self.__cond:
+      self.__val = _UNSET
+      waiters, self.__waiters = self.__waiters, None
+    return [fail for _fn, fail in waiters or () if fail is not None]
+
+def _sequence_key(name):
+  """Sort key that puts sequential children in sequence order, ahead of any
+  others, which sort by name.
+  """
+  suffix = name[-10:]
+  if len(suffix) == 10 and suffix.isdigit():
+    return (suffix, name)
+  return ('~', name)
+
+class ChildIndex(object):
+  """A node's children as sort keys kept in sequence order, for ordered
+  access and to diff against the next list zookeeper sends. Small changes are
+  applied in place, so a directory with many children pays for what changed
+  rather than re-sorting everything. Nodes only build one once a diff watcher
+  or ordered access needs it.
+  """
+  REBUILD = 64
 
-    raise zookeeper.OperationTimeoutException
+  def __init__(self):
+    self.__lock   = Lock()
+    self.__sorted = None
 
-  def _set(self, value):
-    self.__val = value
+  def update(self, children):
+    """Index children in place of whatever was indexed before, and return
+    the (added, removed) lists of names, in sequence order. children is None
+    if the node is gone.
+    """
+    with self.__lock:
+      old = self.__sorted
+      if children is None:
+        self.__sorted = None
+        return [], [key[1] for key in old or ()]
+      if old is None:
+        self.__sorted = sorted(_sequence_key(name) for name in children)
+        return [key[1] for key in self.__sorted], []
+      new     = set(children)
+      removed = [key for key in old if key[1] not in new]
+      new.difference_update(key[1] for key in old)
+      added   = sorted(_sequence_key(name) for name in new)
+      if len(added) + len(removed) > self.REBUILD:
+        self.__sorted = sorted(_sequence_key(name) for name in children)
+      else:
+        for key in removed:
+          del old[bisect_left(old, key)]
+        for key in added:
+          insort(old, key)
+      return [key[1] for key in added], [key[1] for key in removed]
+
+  def ordered(self):
+    with self.__lock:
+      return [key[1] for key in self.__sorted or ()]
+
+  def lowest(self):
+    with self.__lock:
+      if not self.__sorted:
+        return None
+      return self.__sorted[0][1]
+
+  def first(self, count):
+    with self.__lock:
+      return [key[1] for key in (self.__sorted or ())[:count]]
+
+  def before(self, name):
+    """The child just ahead of name in sequence order, or None if there is
+    none. name doesn't have to be a child.
+    """
+    with self.__lock:
+      if not self.__sorted:
+        return None
+      idx = bisect_left(self.__sorted, _sequence_key(name))
+      if idx == 0:
+        return None
+      return self.__sorted[idx - 1][1]
+
+# Nodes only lock around updates from zookeeper, which are brief, so they share
+# these locks, picked by path, instead of each holding its own.
+_NODE_LOCKS = [RLock() for _ in xrange(64)]
 
 class Node(object):
   @fix_path
-  def __init__(self, path, zk):
+  def __init__(self, path, zk, watch=WATCH_BOTH):
     self.__path     = path
     self.__zk       = zk
+    self.__watch    = watch
     self.__value    = Value()
     self.__children = Value()
     self.__val_cbs  = {}
     self.__ch_cbs   = {}
+    self.__diff_cbs = {}
+    self.__index    = None
+    self.__lock     = _NODE_LOCKS[hash(path) % len(_NODE_LOCKS)]
+    self.__evicted  = False
+    self.__stale    = set()
+    self.__read     = 0
     print path, "Node created"
 
   @property
   def path(self):
     return self.__path
 
-  def value(self, timeout=5):
+  def is_stale(self):
+    """Returns True if some of what this node holds was loaded from a snapshot,
+    or filled in when this client created the node, and hasn't yet been
+    confirmed by zookeeper.
+    """
+    return bool(self.__stale)
+
+  def value(self, timeout=5, codec=None):
     """Get the value and metadata for this node. This will raise
-    NoNodeException if the node doesn't exist.
+    NoNodeException if the node doesn't exist. If a codec is given, the value
+    is decoded with it; each version of the value is only decoded once.
+
+    If this node isn't watching its value, every call reads it afresh.
     """
+    self.__read = time.time()
+    if self.__evicted:
+      current = self.__zk._adopt(self)
+      if current is not self:
+        return current.value(timeout, codec)
+    if not self.__watch & WATCH_VALUE:
+      value, meta = self.__zk._aread(self.path).result(timeout)
+      if codec is None:
+        return value, meta
+      return codec.decode(value), meta
     timeout /= 2.0
     try:
-      return self.__value.get(timeout)
+      data = self.__value.get(timeout)
     except zookeeper.OperationTimeoutException:
-      if self.__zk.is_connected():
+      if self.__zk.is_connected(self.path):
         # We are connected to zookeeper, and we have no value at all. Let's
         # try getting it again...
         self.__zk._aget(self.path)
-      return self.__value.get(timeout)
+      data = self.__value.get(timeout)
+    if codec is None:
+      return data.pair()
+    return data.decoded(codec)
 
   def children(self, timeout=5):
     """Get the children of this node. This raises NoNodeException if the node
-    doesn't exist.
+    doesn't exist. If this node isn't watching its children, every call lists
+    them afresh.
     """
+    self.__read = time.time()
+    if self.__evicted:
+      current = self.__zk._adopt(self)
+      if current is not self:
+        return current.children(timeout)
+    if not self.__watch & WATCH_CHILDREN:
+      return self.__zk._aread_children(self.path).result(timeout)
     timeout /= 2.0
     try:
       return self.__children.get(timeout)
     except zookeeper.OperationTimeoutException:
-      if self.__zk.is_connected():
+      if self.__zk.is_connected(self.path):
         # We are connected to zookeeper, and we have no children at all. Let's
         # try getting them again...
         self.__zk._aget_children(self.path)
       return self.__children.get(timeout)
 
+  def avalue(self, codec=None):
+    """Asynchronous version of value. Returns a Future whose result is the
+    (value, meta) pair as soon as zookeeper has told us about this node; it
+    fails with NoNodeException if the node doesn't exist.
+    """
+    self.__read = time.time()
+    if self.__evicted:
+      current = self.__zk._adopt(self)
+      if current is not self:
+        return current.avalue(codec)
+    if not self.__watch & WATCH_VALUE:
+      if codec is None:
+        return self.__zk._aread(self.path)
+      return self.__zk._aread(self.path)._then(
+          lambda pair: (codec.decode(pair[0]), pair[1]))
+    future = Future()
+    def got(data):
+      if data is None:
+        future._set_exception(zookeeper.NoNodeException())
+        return
+      try:
+        if codec is None:
+          future._set_result(data.pair())
+        else:
+          future._set_result(data.decoded(codec))
+      except Exception as exc:
+        future._set_exception(exc)
+    self.__value._on_set(got, future._abandon)
+    future.add_done_callback(lambda _future: self.__value._off_set(got))
+    return future
+
+  def achildren(self):
+    """Asynchronous version of children. Returns a Future whose result is the
+    list of children; it fails with NoNodeException if the node doesn't
+    exist.
+    """
+    self.__read = time.time()
+    if self.__evicted:
+      current = self.__zk._adopt(self)
+      if current is not self:
+        return current.achildren()
+    if not self.__watch & WATCH_CHILDREN:
+      return self.__zk._aread_children(self.path)
+    future = Future()
+    def got(children):
+      if children is None:
+        future._set_exception(zookeeper.NoNodeException())
+      else:
+        future._set_result(children)
+    self.__children._on_set(got, future._abandon)
+    future.add_done_callback(lambda _future: self.__children._off_set(got))
+    return future
+
+  def children_sorted(self, timeout=5):
+    """Get the children of this node in sequence order: sequential children
+    by their sequence numbers, then any others by name.
+    """
+    return self._index_for(timeout).ordered()
+
+  def lowest_child(self, timeout=5):
+    """Get the first child in sequence order, or None if there are no
+    children.
+    """
+    return self._index_for(timeout).lowest()
+
+  def lowest_children(self, count, timeout=5):
+    """Get the first count children in sequence order.
+    """
+    return self._index_for(timeout).first(count)
+
+  def child_before(self, name, timeout=5):
+    """Get the child just ahead of name in sequence order, or None if name
+    would be first.
+    """
+    return self._index_for(timeout).before(name)
+
   def create(self, value='', await_update=1):
     """Create a node at this path; this will fail if this node already has
     data, or in all sorts of connection failure events.
@@ -154,22 +626,27 @@ class Node(object):
       self.value()
       raise NodeExistsException
     except NoNodeException:
-      self.__zk._use_socket(lambda z:
+      self.__zk._write('create', self.path, lambda z:
           zookeeper.create(z, self.path, value, ALL_ACL, 0))
-      self._wait_version(await_update, 0)
+      self._created(value)
 
   def set(self, value, version, await_update=1):
-    """Set the value to store at this node. If this node doesn't exist, this
-    will raise NoNodeException; if the given version isn't the most recently
-    stored in zookeeper, this will raise BadVersionException. Other server
-    errors will raise other exceptions.
+    """Set the value to store at this node, and return its new Meta. If this
+    node doesn't exist, this will raise NoNodeException; if the given version
+    isn't the most recently stored in zookeeper, this will raise
+    BadVersionException. Other server errors will raise other exceptions.
 
     To stomp over the value, regardless of what is stored in zookeeper, set
     version to -1.
+
+    Like create and delete, this applies the write to the node as soon as
+    zookeeper confirms it, so there's nothing to wait for; await_update is
+    ignored, and only kept for older callers.
     """
-    self.__zk._use_socket(lambda z:
-        zookeeper.set(z, self.path, value, version))
-    self._wait_version(await_update, version+1)
+    stat = self.__zk._write('set', self.path, lambda z:
+        zookeeper.set2(z, self.path, value, version))
+    self._val(value, stat)
+    return Meta(stat)
 
   def delete(self, version, await_update=1):
     """Delete the node at this path. This can fail for all sorts of reasons:
@@ -177,90 +654,329 @@ class Node(object):
     node should be deleted regardless of its current version, version can be
     given as -1.
     """
-    self.__zk._use_socket(lambda z: zookeeper.delete(z, self.path, version))
-    self._wait_version(await_update, -1)
+    self.__zk._write('delete', self.path, lambda z:
+        zookeeper.delete(z, self.path, version))
+    self._delete()
+
+  def acreate(self, value=''):
+    """Asynchronous version of create. Returns a Future whose result is this
+    node once zookeeper has created it. Unlike create, this doesn't first
+    check whether the node already exists; the Future fails with
+    NodeExistsException if it does.
+    """
+    return self.__zk._acreate(self.path, value)._then(lambda _path: self)
+
+  def aset(self, value, version):
+    """Asynchronous version of set. Returns a Future whose result is the
+    node's new Meta. The new value is visible through value() as soon as
+    zookeeper accepts it.
+    """
+    return self.__zk._aset(self.path, value, version)._then(Meta)
 
-  def addValueWatcher(self, key, fn):
+  def adelete(self, version):
+    """Asynchronous version of delete. Returns a Future whose result is None
+    once zookeeper has deleted the node.
+    """
+    return self.__zk._adelete(self.path, version)
+
+  def addValueWatcher(self, key, fn, coalesce=False, codec=None):
     """Add a function to be called when the value in this node changes. This
     function will be called with (data, meta) when the node exists, and it
     will be called with None if the node's been deleted. Exceptions thrown by
     fn will be swallowed. The key parameter is used to remove the watcher.
     Keys must be unique; adding different functions with the same key will
     result in previous watchers being replaced.
-    """
-    self._add_cb("value", self.__val_cbs, key, fn)
 
-  def addChildWatcher(self, key, fn):
+    If coalesce is True, updates that arrive while an earlier one is still
+    waiting to be delivered replace it, so fn only sees the latest state. If
+    a codec is given, fn is called with (decoded value, meta) instead.
+
+    A node that wasn't watching its value starts to.
+    """
+    self._add_cb("value", self.__val_cbs, key, _ValueFn(fn, codec), coalesce)
+    current = self._readopt()
+    if current is not self:
+      self.__val_cbs.pop(key, None)
+      return current.addValueWatcher(key, fn, coalesce, codec)
+    self._upgrade(WATCH_VALUE)
+
+  def addChildWatcher(self, key, fn, coalesce=False):
     """Add a function to be called when the children of this node changes.
     This function will be called with [children] when the node exists, and it
     will be called with None if the node's been deleted. Exceptions thrown by
     fn will be swallowed. The key parameter is used to remove the watcher.
     Keys must be unique; adding different functions with the same key will
     result in previous watchers being replaced.
+
+    coalesce works as it does for addValueWatcher, and a node that wasn't
+    watching its children starts to.
     """
-    self._add_cb("child", self.__ch_cbs, key, fn)
+    self._add_cb("child", self.__ch_cbs, key, fn, coalesce)
+    current = self._readopt()
+    if current is not self:
+      self.__ch_cbs.pop(key, None)
+      return current.addChildWatcher(key, fn, coalesce)
+    self._upgrade(WATCH_CHILDREN)
+
+  def addChildDiffWatcher(self, key, fn):
+    """Add a function to be called with (added, removed) lists of child names
+    each time the children of this node change, and with None if the node's
+    been deleted. Diffs build on one another, so they are never coalesced.
+    Keys work as they do for addValueWatcher.
+    """
+    self._add_cb("child diff", self.__diff_cbs, key, fn)
+    current = self._readopt()
+    if current is not self:
+      self.__diff_cbs.pop(key, None)
+      return current.addChildDiffWatcher(key, fn)
+    self._indexed()
+    self._upgrade(WATCH_CHILDREN)
 
   def delValueWatcher(self, key):
     """Remove the watcher that was added with the given key.
     """
     try:             del self.__val_cbs[key]
-    except KeyError: pass
+    except KeyError: return
+    if not self._watched():
+      self.__zk._unwatched(self)
 
   def delChildWatcher(self, key):
     """Remove the watcher that was added with the given key.
     """
     try:             del self.__ch_cbs[key]
-    except KeyError: pass
+    except KeyError: return
+    if not self._watched():
+      self.__zk._unwatched(self)
 
-  def _add_cb(self, desc, dct, key, fn):
-    def catcher(val):
-      try:
-        fn(val)
-      except:
-        print desc, "watcher callback threw this:"
-        traceback.print_exc()
-    dct[key]=catcher
+  def delChildDiffWatcher(self, key):
+    """Remove the watcher that was added with the given key.
+    """
+    try:             del self.__diff_cbs[key]
+    except KeyError: return
+    if not self._watched():
+      self.__zk._unwatched(self)
 
-  def _delete(self):
-    """Only to be called by zk, update that this node is deleted.
+  def _watched(self):
+    """Whether anybody has attached watchers to this node.
     """
-    try:
-      already_deleted = (self.__value._wait(0) is None)
-    except zookeeper.OperationTimeoutException:
-      already_deleted = False
+    return bool(self.__val_cbs or self.__ch_cbs or self.__diff_cbs)
+
+  def _watching(self):
+    """The WATCH_ flags for what this node keeps watches on.
+    """
+    return self.__watch
+
+  def _upgrade(self, watch):
+    """Start watching whatever watch asks for that this node isn't watching
+    yet. Modes only ever grow; watches can't be taken back from zookeeper.
+    """
+    with self.__lock:
+      added         = watch & ~self.__watch
+      self.__watch |= added
+    if added and not self.__evicted:
+      self.__zk._fetch(self, added)
+
+  def _last_read(self):
+    """When value() or children() was last called on this node.
+    """
+    return self.__read
+
+  def _index_for(self, timeout):
+    """Wait for this node's children, and return the ChildIndex holding them.
+    The index is only kept for watched children, so this starts watching them
+    if need be, and builds the index if this is the first time it's needed.
+    """
+    self.__read = time.time()
+    if self.__evicted:
+      current = self.__zk._adopt(self)
+      if current is not self:
+        return current._index_for(timeout)
+    index = self._indexed()
+    self._upgrade(WATCH_CHILDREN)
+    self.children(timeout)
+    return index
+
+  def _indexed(self):
+    """This node's ChildIndex, which is built from the children we know the
+    first time it's asked for.
+    """
+    with self.__lock:
+      if self.__index is None:
+        self.__index = ChildIndex()
+        self.__index.update(self._immed_raw_children())
+      return self.__index
+
+  def _readopt(self):
+    """Called once a watcher has been attached. A watched node can't be
+    evicted, so if this one already was, it's put back into the mirror.
+    Returns whichever node is mirroring the path, which is another one if
+    something else has taken the path since; the watcher then belongs there.
+    """
+    return self.__zk._adopt(self)
+
+  def _add_cb(self, desc, dct, key, fn, coalesce=False):
+    if coalesce:
+      dct[key] = CoalescingWatcher(desc, fn)
+    else:
+      dct[key] = Watcher(desc, fn)
+
+  def _notify(self, watchers, get_val):
+    for watcher in watchers.values():
+      watcher._notify(self.__zk._run_async, self.path, get_val)
+
+  def _evict(self):
+    """Only to be called by zk, when it stops mirroring this node. What we
+    know about the node is dropped, since it won't be kept up to date.
+    """
+    self.__evicted = True
+    self._forget()
+
+  def _adopted(self):
+    """Only to be called by zk, when an evicted node is mirrored again. Any
+    late answer that landed after the eviction is dropped too.
+    """
+    self.__evicted = False
+    self._forget()
+
+  def _forget(self):
+    """Drop what we know about the node. Reads still waiting on it fail; zk
+    calls this with its own lock held, so they're failed from the dispatcher.
+    """
+    for fail in self.__value._clear() + self.__children._clear():
+      self.__zk._run_async(fail, self.path)
+    self.__index = None
 
-    if not already_deleted:
-      # Only call the callbacks if we didn't already know that we were
-      # deleted.
-      for fn in self.__val_cbs.values():
-        self.__zk._run_async(lambda: fn(None))
-      for fn in self.__ch_cbs.values():
-        self.__zk._run_async(lambda: fn(None))
+  def _snapshot(self):
+    """Only to be called by zk; describe what we know of this node as a
+    snapshot Entry, or return None if we know nothing.
+    """
+    value    = self.__value._peek()
+    children = self.__children._peek()
+    if value is None:
+      return Entry(self.path, deleted=True)
+    if value is _UNSET and children in (_UNSET, None):
+      return None
+    entry = Entry(self.path)
+    if value is not _UNSET:
+      entry.value = value.value
+      entry.stat  = value.meta._asdict()
+    if children not in (_UNSET, None):
+      entry.children = children
+    return entry
+
+  def _preload(self, entry):
+    """Only to be called by zk; fill in whatever zookeeper hasn't already told
+    us from a snapshot Entry. Anything filled in is stale until zookeeper
+    confirms it.
+    """
+    if entry.deleted:
+      value    = None
+      children = None
+    else:
+      value    = _UNSET
+      children = _UNSET
+      if entry.stat is not None:
+        value = Data(entry.value, entry.stat)
+      if entry.children is not None:
+        children = entry.children
+    if value is not _UNSET and self.__value._set_if_unset(value):
+      self.__stale.add('value')
+    if children is not _UNSET and self.__children._set_if_unset(children):
+      if self.__index is not None:
+        self.__index.update(children)
+      self.__stale.add('children')
 
-    self.__value._set(None)
-    self.__children._set(None)
-    print self.path, "marked as deleted"
+  def _delete(self):
+    """Only to be called by zk, update that this node is deleted.
+    """
+    with self.__lock:
+      self.__stale.clear()
+      known = self.__value
+      if not self.__watch & WATCH_VALUE:
+        known = self.__children
+      try:
+        already_deleted = (known._wait(0) is None)
+      except zookeeper.OperationTimeoutException:
+        already_deleted = False
+
+      if not already_deleted:
+        # Only call the callbacks if we didn't already know that we were
+        # deleted.
+        self._notify(self.__val_cbs, lambda: None)
+        self._notify(self.__ch_cbs, lambda: None)
+        self._notify(self.__diff_cbs, lambda: None)
+
+      if self.__index is not None:
+        self.__index.update(None)
+      if self.__watch & WATCH_VALUE:
+        self.__value._set(None)
+      if self.__watch & WATCH_CHILDREN:
+        self.__children._set(None)
+      print self.path, "marked as deleted"
 
   def _val(self, value, meta):
     """Only to be called by zk, update this node's stored value.
     """
-    meta = Meta(meta)
-    stored = self._immed_raw_value()
-    if (stored is None) or (stored[1].version != meta.version):
-      for fn in self.__val_cbs.values():
-        self.__zk._run_async(lambda: fn( (value, meta) ))
-    self.__value._set( (value, meta) )
-    print self.path, "value set"
+    with self.__lock:
+      if not self.__watch & WATCH_VALUE:
+        # Nothing would keep it current
+        return
+      data   = Data(value, meta)
+      stored = self._immed_raw_value()
+      if stored is not None and data.older_than(stored):
+        # An answer that was overtaken by a write we've already applied
+        return
+      self.__stale.discard('value')
+      if (stored is None) or not stored.same_version(data):
+        self._notify(self.__val_cbs, lambda: data)
+      else:
+        data.inherit(stored)
+      self.__value._set(data)
+      print self.path, "value set"
+
+  def _created(self, value):
+    """Only to be called by zk, when zookeeper confirms that this node was
+    created with value. Until the watch brings the full stat, the node holds
+    a provisional one, with version 0, an unknown czxid and zxids, and local
+    times, and reports is_stale(); the real one then replaces it without
+    calling watchers again.
+    """
+    with self.__lock:
+      if self.__watch & WATCH_VALUE and self._immed_raw_value() is None:
+        now = int(time.time() * 1000)
+        self._val(value, {
+          'version':     0,
+          'ctime':       now,
+          'mtime':       now,
+          'dataLength':  len(value or ''),
+          'numChildren': 0,
+          })
+        self.__stale.add('value')
+      if self.__watch & WATCH_CHILDREN and self._immed_raw_children() is None:
+        self._children([])
+        self.__stale.add('children')
 
   def _children(self, children):
     """Only to be called by zk, update this node's children.
     """
-    existing = self._immed_raw_children()
-    if (existing is None) or (existing != children):
-      for fn in self.__ch_cbs.values():
-        self.__zk._run_async(lambda: fn( children ))
-    self.__children._set(children)
-    print self.path, "children set"
+    with self.__lock:
+      if not self.__watch & WATCH_CHILDREN:
+        return
+      existing = self._immed_raw_children()
+      self.__stale.discard('children')
+      self.__children._set(children)
+      if self.__index is None:
+        # Nobody diffs or orders these children
+        if (existing is None) or existing != children:
+          self._notify(self.__ch_cbs, lambda: children)
+        print self.path, "children set"
+        return
+      added, removed = self.__index.update(children)
+      if (existing is None) or added or removed:
+        self._notify(self.__ch_cbs, lambda: children)
+      if added or removed:
+        self._notify(self.__diff_cbs, lambda: (added, removed))
+      print self.path, "children set"
 
   def _immed_raw_value(self):
     try:
@@ -273,20 +989,3 @@ class Node(object):
       return self.__children._wait(0)
     except zookeeper.OperationTimeoutException:
       return None
-
-  def _wait_version(self, timeout, version):
-    """Wait for this node's version to be at least the given version. If the
-    version is -1, this waits for the node to be deleted.
-    """
-    giveup = time.time() + timeout
-    while time.time() < giveup:
-      try:
-        cur_version = self.value(0)[1].version
-      except NoNodeException:
-        cur_version = -1
-
-      if version == cur_version:
-        return
-      if 0 <= version <= cur_version:
-        return
-      time.sleep(TINY_SLEEP)
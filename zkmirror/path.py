@@ -0,0 +1,173 @@
+"""Canonical zookeeper paths, and an index of values by path.
+"""
+
+class Path(str):
+  """A normalized path: a single leading slash, no trailing or repeated
+  slashes. Making a Path from a Path returns it untouched, so code that
+  normalizes its arguments (see zk.fix_path) costs nothing when handed paths
+  that are already canonical, such as a node's own path.
+  """
+  __slots__ = ()
+
+  def __new__(cls, path):
+    if type(path) is cls:
+      return path
+    return str.__new__(cls, '/' + '/'.join(filter(None, path.split('/'))))
+
+  @property
+  def name(self):
+    """The last component of the path; empty for the root.
+    """
+    return self[self.rfind('/')+1:]
+
+  @property
+  def parent(self):
+    """The path one level up, or None for the root.
+    """
+    if self == '/':
+      return None
+    return str.__new__(Path, self[:self.rfind('/')] or '/')
+
+  def child(self, name):
+    """The path of the child called name, which must not contain slashes.
+    """
+    if self == '/':
+      return str.__new__(Path, '/' + name)
+    return str.__new__(Path, self + '/' + name)
+
+  def components(self):
+    return [part for part in self.split('/') if part]
+
+_MISSING = object()
+
+class _Entry(object):
+  __slots__ = ('value', 'children')
+
+  def __init__(self):
+    self.value    = _MISSING
+    self.children = None
+
+class PathIndex(object):
+  """Values keyed by path, held in a trie of path components. Besides plain
+  lookups, this finds everything at or below a path, or whose path starts
+  with a given string, without looking at anything else, and finds the
+  nearest indexed ancestor of a path in time proportional to its depth.
+  Callers must do their own locking.
+  """
+  def __init__(self):
+    self.__root = _Entry()
+    self.__len  = 0
+
+  def __len__(self):
+    return self.__len
+
+  def __contains__(self, path):
+    return self.get(path, _MISSING) is not _MISSING
+
+  def get(self, path, default=None):
+    entry = self._find(Path(path).components())
+    if entry is None or entry.value is _MISSING:
+      return default
+    return entry.value
+
+  def __setitem__(self, path, value):
+    entry = self.__root
+    for part in Path(path).components():
+      if entry.children is None:
+        entry.children = {}
+      child = entry.children.get(part)
+      if child is None:
+        child = entry.children[part] = _Entry()
+      entry = child
+    if entry.value is _MISSING:
+      self.__len += 1
+    entry.value = value
+
+  def pop(self, path, default=None):
+    """Remove path's value and return it, or return default if there isn't
+    one. Entries left with nothing in or below them are pruned.
+    """
+    parts = Path(path).components()
+    trail = [self.__root]
+    for part in parts:
+      children = trail[-1].children
+      if not children or part not in children:
+        return default
+      trail.append(children[part])
+    entry = trail[-1]
+    if entry.value is _MISSING:
+      return default
+    value, entry.value = entry.value, _MISSING
+    self.__len -= 1
+    for depth in range(len(parts), 0, -1):
+      entry = trail[depth]
+      if entry.value is not _MISSING or entry.children:
+        break
+      del trail[depth-1].children[parts[depth-1]]
+    return value
+
+  def walk(self, path):
+    """List the (path, value) pairs at and below path, parents ahead of their
+    children.
+    """
+    path  = Path(path)
+    entry = self._find(path.components())
+    found = []
+    if entry is not None:
+      self._collect(path, entry, found)
+    return found
+
+  def find(self, prefix):
+    """List the (path, value) pairs whose paths start with the string prefix,
+    along with everything below them.
+    """
+    base, _, start = prefix.rpartition('/')
+    base  = Path(base)
+    entry = self._find(base.components())
+    found = []
+    if entry is None:
+      return found
+    if not start and entry.value is not _MISSING and base.startswith(prefix):
+      found.append((base, entry.value))
+    for name in sorted(entry.children or ()):
+      if name.startswith(start):
+        self._collect(base.child(name), entry.children[name], found)
+    return found
+
+  def nearest(self, path):
+    """Return the (path, value) pair of the deepest indexed proper ancestor
+    of path, or None if no ancestor is indexed.
+    """
+    path  = Path(path)
+    parts = path.components()
+    entry = self.__root
+    best  = None
+    if entry.value is not _MISSING and parts:
+      best = (Path('/'), entry.value)
+    for depth, part in enumerate(parts[:-1]):
+      if not entry.children or part not in entry.children:
+        break
+      entry = entry.children[part]
+      if entry.value is not _MISSING:
+        best = (Path('/' + '/'.join(parts[:depth+1])), entry.value)
+    return best
+
+  def _find(self, parts):
+    entry = self.__root
+    for part in parts:
+      if not entry.children:
+        return None
+      entry = entry.children.get(part)
+      if entry is None:
+        return None
+    return entry
+
+  def _collect(self, path, entry, found):
+    stack = [(path, entry)]
+    while stack:
+      path, entry = stack.pop()
+      if entry.value is not _MISSING:
+        found.append((path, entry.value))
+      if entry.children:
+        stack.extend((path.child(name), entry.children[name])
+            for name in sorted(entry.children, reverse=True))
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+from threading import Lock
+
+class PendingQueue(object):
+  """Requests that failed while zookeeper was unreachable, waiting to be
+  retried once we reconnect. Each retry is keyed by (operation, path), so
+  repeated failures of the same request only queue it once, and retries are
+  replayed in the order they were first queued.
+
+  If limit is given, the queue holds at most that many retries. Retries that
+  don't fit are dropped, and the queue remembers that it overflowed so that
+  the mirror can fall back to resyncing everything instead.
+  """
+  def __init__(self, limit=None):
+    self.__lock     = Lock()
+    self.__actions  = OrderedDict()
+    self.__limit    = limit
+    self.__overflow = False
+    self.__merged   = 0
+    self.__dropped  = 0
+
+  def add(self, key, action):
+    with self.__lock:
+      if key in self.__actions:
+        self.__merged += 1
+        return
+      if self.__limit is not None and len(self.__actions) >= self.__limit:
+        self.__dropped += 1
+        self.__overflow = True
+        return
+      self.__actions[key] = action
+
+  def drain(self):
+    """Empty the queue, returning the queued actions in FIFO order and whether
+    any retries were dropped since the last drain.
+    """
+    with self.__lock:
+      actions         = list(self.__actions.values())
+      overflowed      = self.__overflow
+      self.__actions  = OrderedDict()
+      self.__overflow = False
+    return actions, overflowed
+
+  def __len__(self):
+    return len(self.__actions)
+
+  def stats(self):
+    """Return a dict with the number of queued retries, the limit on that
+    number, and how many retries were merged into queued ones or dropped.
+    """
+    with self.__lock:
+      return {
+          'depth':   len(self.__actions),
+          'limit':   self.__limit,
+          'merged':  self.__merged,
+          'dropped': self.__dropped,
+          }
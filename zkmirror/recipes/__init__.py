@@ -0,0 +1,13 @@
+"""Coordination recipes built on top of Mirror.
+"""
+from .queue import Queue
+from .lock import Lock
+from .lock import ReadWriteLock
+from .election import Election
+
+__all__ = [
+    Queue,
+    Lock,
+    ReadWriteLock,
+    Election,
+    ]
@@ -0,0 +1,45 @@
+"""Leader election; the candidate at the head of the line leads.
+
+Candidates line up the way lock contenders do, each watching only the one
+ahead of it, so a leader stepping down or dying wakes just its successor.
+"""
+from ..node import _sequence_key
+from ..zk import NoNodeException
+from .lock import Lock
+
+class Election(Lock):
+  """value identifies this candidate to anybody asking who leads. on_lost is
+  called if we lead and our session expires.
+  """
+  prefix = 'candidate-'
+
+  def campaign(self, timeout=None):
+    """Wait until we lead, and return True, or give up and return False
+    after timeout seconds.
+    """
+    return self.acquire(timeout)
+
+  def resign(self):
+    """Stop leading, or stop waiting to.
+    """
+    self.release()
+
+  def is_leader(self):
+    return self.is_held()
+
+  def leader(self, timeout=5):
+    """Return the value of the current leader, or None if nobody leads.
+    """
+    mirror = self.mirror
+    while True:
+      children   = mirror._aread_children(self.path).result(timeout)
+      candidates = [name for name in children if name.startswith(self.prefix)]
+      if not candidates:
+        return None
+      head = min(candidates, key=_sequence_key)
+      try:
+        return mirror._aread(self.path.child(head),
+            via=self.path).result(timeout)[0]
+      except NoNodeException:
+        # Stepped down as we asked; look again
+        pass
@@ -0,0 +1,221 @@
+"""Locks built from EPHEMERAL|SEQUENCE contender znodes.
+
+Contenders queue up as sequential children of the lock's znode, and the
+lowest one holds the lock. Each waiting contender watches only the node just
+ahead of it, through a one-shot exists watch, so releasing the lock wakes
+exactly one waiter rather than every contender. Contender nodes are
+ephemeral, so a holder whose session expires drops the lock; it is told
+through its mirror's state watchers. Every request goes through the session
+serving the lock's path, so they are all applied in order.
+"""
+from threading import Condition
+import threading
+import time
+
+from .. import alarm
+from ..node import _sequence_key
+from ..zk import EPHEMERAL
+from ..zk import EXPIRED_SESSION_STATE
+from ..zk import NoNodeException
+from ..zk import OperationTimeoutException
+from ..zk import SEQUENCE
+from ..zk import SessionExpiredException
+from ..zk import normalize
+
+# How long acquire waits for zookeeper to answer each request it makes; the
+# caller's timeout only limits the wait for the contenders ahead of us
+REQUEST_TIMEOUT = 5
+
+def _remaining(deadline):
+  if deadline is None:
+    return None
+  return max(0, deadline - time.time())
+
+class Lock(object):
+  """An exclusive lock. on_lost, if given, is called if the lock is dropped
+  because the session holding it expired.
+  """
+  prefix = 'lock-'
+
+  def __init__(self, mirror, path, value='', on_lost=None):
+    path = normalize(path)
+    # The lock's node isn't mirrored: its children change with every
+    # contender, and only the one just behind each contender needs to know
+    mirror.ensure_paths([path])
+    self.__mirror  = mirror
+    self.__path    = path
+    self.__value   = value
+    self.__on_lost = on_lost
+    self.__cond    = Condition(threading.Lock())
+    self.__name    = None
+    self.__held    = False
+    self.__expired = False
+
+  @property
+  def mirror(self):
+    return self.__mirror
+
+  @property
+  def path(self):
+    return self.__path
+
+  @property
+  def name(self):
+    """The name of our contender node, while we have one.
+    """
+    return self.__name
+
+  def is_held(self):
+    return self.__held
+
+  def acquire(self, timeout=None):
+    """Wait until we hold the lock, and return True. If timeout seconds pass
+    first, give up our place and return False; with a timeout of 0, this
+    only takes the lock if nobody holds it. Raises SessionExpiredException
+    if the session expires while waiting.
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    with self.__cond:
+      if self.__name is not None:
+        raise RuntimeError('%s is already held or being acquired' % self.__path)
+      self.__expired = False
+    self.__mirror.addStateWatcher(self._key(), self._state, self.__path)
+    creating = self.__mirror._acreate(self.__path.child(self.prefix),
+        self.__value, EPHEMERAL | SEQUENCE, via=self.__path)
+    try:
+      created = creating.result(REQUEST_TIMEOUT)
+    except OperationTimeoutException:
+      # The contender may still be created after we give up; if it is, it
+      # must not stay in line
+      creating.add_done_callback(self._abandon)
+      self._withdraw()
+      return False
+    except:
+      self._withdraw()
+      raise
+    try:
+      self.__name = created.rsplit('/', 1)[1]
+      while True:
+        try:
+          children = self.__mirror._aread_children(self.__path,
+              via=self.__path).result(REQUEST_TIMEOUT)
+        except OperationTimeoutException:
+          self._withdraw()
+          return False
+        if self.__name not in children:
+          raise SessionExpiredException
+        ahead = self._predecessor(children)
+        if ahead is None:
+          self.__held = True
+          return True
+        gone = self.__mirror._await_gone(self.__path.child(ahead),
+            via=self.__path)
+        gone.add_done_callback(lambda _future: self._wake())
+        with self.__cond:
+          while not gone.done() and not self.__expired:
+            remaining = _remaining(deadline)
+            if remaining == 0:
+              break
+            alarm.wait(self.__cond, remaining)
+          if self.__expired:
+            raise SessionExpiredException
+        if not gone.done():
+          self._withdraw()
+          return False
+    except:
+      self._withdraw()
+      raise
+
+  def release(self):
+    """Give up the lock, or our place in line for it.
+    """
+    self._withdraw()
+
+  def __enter__(self):
+    self.acquire()
+    return self
+
+  def __exit__(self, *exc):
+    self.release()
+
+  def _blocks(self, name):
+    """Whether the contender called name, if it is ahead of us, keeps us
+    from holding the lock.
+    """
+    return True
+
+  def _predecessor(self, children):
+    """The blocking contender just ahead of ours, or None if there is none.
+    """
+    mine  = _sequence_key(self.__name)
+    ahead = [key for key in map(_sequence_key, children)
+        if key < mine and self._blocks(key[1])]
+    if not ahead:
+      return None
+    return max(ahead)[1]
+
+  def _withdraw(self):
+    self.__mirror.delStateWatcher(self._key())
+    name, self.__name = self.__name, None
+    self.__held = False
+    if name is not None:
+      try:
+        self.__mirror._adelete(self.__path.child(name), -1,
+            via=self.__path).result(5)
+      except NoNodeException:
+        pass
+
+  def _abandon(self, creating):
+    """Delete a contender that zookeeper created after acquire gave up.
+    """
+    if creating.exception() is None:
+      self.__mirror._adelete(creating.result(), -1, via=self.__path)
+
+  def _key(self):
+    return ('lock', id(self))
+
+  def _wake(self):
+    with self.__cond:
+      self.__cond.notify_all()
+
+  def _state(self, state):
+    if state != EXPIRED_SESSION_STATE:
+      return
+    with self.__cond:
+      self.__expired = True
+      held, self.__held = self.__held, False
+      self.__name = None
+      self.__cond.notify_all()
+    self.__mirror.delStateWatcher(self._key())
+    if held and self.__on_lost is not None:
+      self.__on_lost()
+
+class ReadLock(Lock):
+  """The shared half of a ReadWriteLock; only writers ahead of us block it.
+  """
+  prefix = 'read-'
+
+  def _blocks(self, name):
+    return name.startswith(WriteLock.prefix)
+
+class WriteLock(Lock):
+  """The exclusive half of a ReadWriteLock; everyone ahead of us blocks it.
+  """
+  prefix = 'write-'
+
+class ReadWriteLock(object):
+  """Any number of readers, or one writer, at a time. Readers and writers
+  share one line, so a waiting writer holds up readers that come after it.
+  """
+  def __init__(self, mirror, path, on_lost=None):
+    self.__mirror  = mirror
+    self.__path    = normalize(path)
+    self.__on_lost = on_lost
+
+  def read_lock(self, value=''):
+    """A new ReadLock on this lock; each holder needs its own.
+    """
+    return ReadLock(self.__mirror, self.__path, value, self.__on_lost)
+
+  def write_lock(self, value=''):
+    return WriteLock(self.__mirror, self.__path, value, self.__on_lost)
@@ -0,0 +1,175 @@
+"""A FIFO work queue kept as sequential children of one znode.
+
+Producers add items with pipelined SEQUENCE creates, so a batch costs one
+round trip. Consumers find work through the mirrored, sequence-ordered child
+index instead of polling, and claim items by deleting them in order: whoever
+deletes an item owns it, and a consumer that loses an item to another simply
+moves on to the next one rather than retrying the head. Consumers start at
+random offsets near the head, so they seldom contend for the same items.
+"""
+from threading import Condition, Lock
+import random
+import time
+
+from .. import alarm
+from ..zk import NoNodeException
+from ..zk import OperationTimeoutException
+from ..zk import SEQUENCE
+from ..zk import normalize
+from ..node import WATCH_CHILDREN
+
+PREFIX = 'item-'
+
+# How long _claim waits on the reads and deletes it sends
+CLAIM_TIMEOUT = 5
+
+# Consumers choose their items from this many batches' worth at the head
+SPREAD = 4
+
+class Queue(object):
+  def __init__(self, mirror, path):
+    path = normalize(path)
+    mirror.ensure_paths([path])
+    self.__mirror = mirror
+    self.__path   = path
+    self.__node   = mirror.get(path, WATCH_CHILDREN)
+    self.__cond   = Condition(Lock())
+    self.__lost   = set()
+    self.__ready  = []
+    self.__node.addChildDiffWatcher(('queue', id(self)), self._changed)
+
+  @property
+  def path(self):
+    return self.__path
+
+  def __len__(self):
+    return len(self.__node.children())
+
+  def put(self, value, timeout=5):
+    """Add value to the end of the queue, and return the item's name.
+    """
+    return self.put_many([value], timeout)[0]
+
+  def put_many(self, values, timeout=5):
+    """Add values to the end of the queue, in order. The creates are sent
+    without waiting on one another; zookeeper applies them in order, so the
+    items keep the order they were given in. Returns the items' names.
+    """
+    deadline = time.time() + timeout
+    futures  = [self.__mirror._acreate(self.__path.child(PREFIX), value,
+      SEQUENCE, via=self.__path) for value in values]
+    return [future.result(max(0, deadline - time.time())).rsplit('/', 1)[1]
+        for future in futures]
+
+  def take(self, timeout=5):
+    """Remove the item at the head of the queue and return its value. Raises
+    OperationTimeoutException if the queue stays empty for timeout seconds.
+    """
+    items = self.take_many(1, timeout)
+    if not items:
+      raise OperationTimeoutException
+    return items[0]
+
+  def take_many(self, count, timeout=5):
+    """Remove up to count items from near the head of the queue and return
+    their values, in order. This waits up to timeout seconds for the queue to
+    have anything in it, and returns an empty list if it never does; the
+    timeout only limits the search for work, and claiming items found in
+    time is given CLAIM_TIMEOUT of its own.
+
+    Consumers pick their batch at a random offset among the first SPREAD
+    times count items, so that they don't all race for the same head items;
+    items close together may be handed out slightly out of order.
+    """
+    deadline = time.time() + timeout
+    while True:
+      with self.__cond:
+        if self.__ready:
+          values       = self.__ready[:count]
+          self.__ready = self.__ready[count:]
+          return values
+        lost = set(self.__lost)
+      names = [name for name in
+          self._head(count * SPREAD + len(lost), deadline - time.time())
+          if name not in lost]
+      if names:
+        first  = random.randrange(max(1, len(names) - count + 1))
+        values = self._claim(names[first:first + count])
+        if values:
+          return values
+        if time.time() < deadline:
+          continue
+      with self.__cond:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return []
+        if not self.__ready and not self._head(1, 0):
+          alarm.wait(self.__cond, remaining)
+
+  def _head(self, count, timeout):
+    """The first count children in sequence order, or [] if they can't be
+    had within timeout seconds.
+    """
+    try:
+      return self.__node.lowest_children(count, max(0, timeout))
+    except OperationTimeoutException:
+      return []
+
+  def _claim(self, names):
+    """Read the named items, then delete them in order, all pipelined.
+    Returns the values of the items this deleted; the rest went to other
+    consumers, or are left queued if reading them failed. Nothing is raised
+    once a delete has been sent: a delete still unanswered after
+    CLAIM_TIMEOUT has its value kept for a later take if it succeeds.
+    """
+    deadline = time.time() + CLAIM_TIMEOUT
+    paths    = [self.__path.child(name) for name in names]
+    reads    = [self.__mirror._aread(path, via=self.__path) for path in paths]
+    deletes  = []
+    for path, read in zip(paths, reads):
+      try:
+        value, meta = read.result(max(0, deadline - time.time()))
+      except NoNodeException:
+        self._lose(path)
+        continue
+      except Exception:
+        # Nothing has been deleted on the strength of this read, so the item
+        # stays queued; the later ones wait their turn behind it
+        break
+      deletes.append((path, value,
+        self.__mirror._adelete(path, meta.version, via=self.__path)))
+
+    values = []
+    for path, value, future in deletes:
+      try:
+        exc = future.exception(max(0, deadline - time.time()))
+      except OperationTimeoutException:
+        future.add_done_callback(
+            lambda done, path=path, value=value: self._late(done, path, value))
+        continue
+      if exc is None:
+        values.append(value)
+      elif isinstance(exc, NoNodeException):
+        self._lose(path)
+    return values
+
+  def _late(self, future, path, value):
+    """Called when a delete _claim stopped waiting for is answered.
+    """
+    exc = future.exception()
+    if exc is None:
+      with self.__cond:
+        self.__ready.append(value)
+        self.__cond.notify_all()
+    elif isinstance(exc, NoNodeException):
+      self._lose(path)
+
+  def _lose(self, path):
+    with self.__cond:
+      self.__lost.add(path.rsplit('/', 1)[1])
+
+  def _changed(self, diff):
+    with self.__cond:
+      if diff is not None:
+        self.__lost.difference_update(diff[1])
+      self.__cond.notify_all()
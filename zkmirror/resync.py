@@ -0,0 +1,93 @@
+from threading import Lock
+import time
+
+class Resync(object):
+  """Re-establishes the watches on a set of nodes after their session expired,
+  without flooding zookeeper: at most max_inflight nodes have requests
+  outstanding at any time, and another node is only set up once an earlier
+  one's requests have been answered. Nodes with watchers go first, then the
+  most recently read ones.
+  """
+  def __init__(self, setup, nodes, max_inflight):
+    self.__setup     = setup
+    self.__max       = max(1, max_inflight)
+    # Lowest priority first, so the next node to set up is at the end
+    self.__queue     = sorted(nodes, key=_priority)
+    self.__lock      = Lock()
+    self.__total     = len(self.__queue)
+    self.__done      = 0
+    self.__inflight  = 0
+    self.__filling   = False
+    self.__again     = False
+    self.__cancelled = False
+    self.__started   = time.time()
+    self.__finished  = None if self.__queue else self.__started
+
+  def start(self):
+    self._fill()
+
+  def cancel(self):
+    """Stop setting up nodes; requests already sent are left to finish.
+    """
+    with self.__lock:
+      self.__cancelled = True
+      self.__queue     = []
+
+  def progress(self):
+    """Return a dict saying how many nodes this resync covers, how many have
+    been set up, how many are in flight, and how long it has been running (or
+    took, once finished).
+    """
+    with self.__lock:
+      end = self.__finished or time.time()
+      return {
+          'total':     self.__total,
+          'done':      self.__done,
+          'inflight':  self.__inflight,
+          'running':   self.__finished is None and not self.__cancelled,
+          'elapsed':   end - self.__started,
+          }
+
+  def _fill(self):
+    """Set up queued nodes until max_inflight are outstanding. Only one thread
+    fills at a time; a thread that finds another one filling asks it to go
+    around again instead.
+    """
+    while True:
+      with self.__lock:
+        if self.__filling:
+          self.__again = True
+          return
+        self.__filling = True
+        self.__again   = False
+      while True:
+        with self.__lock:
+          if not self.__queue or self.__inflight >= self.__max:
+            break
+          node = self.__queue.pop()
+          self.__inflight += 1
+        self.__setup(node, self._countdown(2))
+      with self.__lock:
+        self.__filling = False
+        if not self.__again:
+          return
+
+  def _countdown(self, requests):
+    """Build the function each of a node's setup requests calls when it is
+    answered; once all of them have, the node's slot is freed up.
+    """
+    remaining = [requests]
+    def done():
+      with self.__lock:
+        remaining[0] -= 1
+        if remaining[0]:
+          return
+        self.__inflight -= 1
+        self.__done     += 1
+        if self.__done == self.__total:
+          self.__finished = time.time()
+      self._fill()
+    return done
+
+def _priority(node):
+  return (node._watched(), node._last_read())
@@ -0,0 +1,26 @@
+from threading import Lock
+import time
+
+from .pending import PendingQueue
+
+class Session(object):
+  """One zookeeper handle, and the connection state that goes with it: the
+  lock that requests take to use the handle, the last session state seen,
+  when the connection was lost, the retries waiting for it to come back, and
+  the resync that follows an expiry. A Mirror has one of these per session
+  it opens, and each reconnects and resyncs on its own.
+  """
+  def __init__(self, index, max_pending):
+    self.index        = index
+    self.lock         = Lock()
+    self.handle       = -1
+    self.state        = 0
+    self.disconnected = time.time()
+    self.pending      = PendingQueue(max_pending)
+    self.resync       = None
+
+  def use(self, action):
+    """Run action with this session's handle, holding its lock.
+    """
+    with self.lock:
+      return action(self.handle)
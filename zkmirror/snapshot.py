@@ -0,0 +1,129 @@
+"""Snapshot files hold what a Mirror knew about its nodes, so that a restarted
+process can serve reads right away while it revalidates against zookeeper.
+
+A snapshot is a header followed by one record per node. Each record is a
+fixed-size struct (path length, flags, value length, children length and the
+eleven stat fields), then the path, value and NUL-separated children names.
+Everything is little-endian, and files are read through mmap.
+"""
+from .zk import STAT_FIELDS
+import struct
+import mmap
+import os
+
+MAGIC   = 'ZKMS'
+VERSION = 1
+
+HAS_VALUE    = 1
+HAS_CHILDREN = 2
+DELETED      = 4
+NULL_VALUE   = 8
+
+_HEADER = struct.Struct('<4sII')
+_RECORD = struct.Struct('<HBII' + 'q' * len(STAT_FIELDS))
+
+class Entry(object):
+  """One node's worth of a snapshot. value and stat are None if the node's
+  value wasn't known; children is None if its children weren't known. If the
+  node was known to be deleted, deleted is True and the rest is None.
+  """
+  __slots__ = ('path', 'value', 'stat', 'children', 'deleted')
+
+  def __init__(self, path, value=None, stat=None, children=None,
+      deleted=False):
+    self.path     = path
+    self.value    = value
+    self.stat     = stat
+    self.children = children
+    self.deleted  = deleted
+
+def save(filename, entries):
+  """Write the given Entries to filename. The file is written alongside and
+  renamed into place, so readers never see a partial snapshot, and it's
+  removed if writing fails.
+  """
+  tmpname = '%s.%d.tmp' % (filename, os.getpid())
+  count   = 0
+  try:
+    with open(tmpname, 'wb') as out:
+      out.write(_HEADER.pack(MAGIC, VERSION, 0))
+      for entry in entries:
+        _write_entry(out, entry)
+        count += 1
+      out.seek(0)
+      out.write(_HEADER.pack(MAGIC, VERSION, count))
+    os.rename(tmpname, filename)
+  except:
+    try:
+      os.unlink(tmpname)
+    except OSError:
+      pass
+    raise
+  return count
+
+def _write_entry(out, entry):
+  flags    = 0
+  value    = ''
+  children = ''
+  stat     = [0] * len(STAT_FIELDS)
+  if entry.deleted:
+    flags |= DELETED
+  else:
+    if entry.stat is not None:
+      flags |= HAS_VALUE
+      value  = entry.value
+      stat   = [entry.stat.get(field, 0) for field in STAT_FIELDS]
+      if value is None:
+        # Null data, as clients other than zkpython can store
+        flags |= NULL_VALUE
+        value  = ''
+    if entry.children is not None:
+      flags   |= HAS_CHILDREN
+      children = '\0'.join(entry.children)
+  path = entry.path
+  if isinstance(path, unicode):
+    path = path.encode('utf-8')
+  out.write(_RECORD.pack(len(path), flags, len(value), len(children), *stat))
+  out.write(path)
+  out.write(value)
+  out.write(children)
+
+def load(filename):
+  """Read the Entries stored in filename. Raises ValueError if the file isn't
+  a snapshot this version of zkmirror understands.
+  """
+  with open(filename, 'rb') as src:
+    size = os.fstat(src.fileno()).st_size
+    if size < _HEADER.size:
+      raise ValueError('%s is too short to be a snapshot' % filename)
+    mapped = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+  try:
+    magic, version, count = _HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('%s is not a version %d snapshot' % (filename, VERSION))
+    entries = []
+    offset  = _HEADER.size
+    for _ in xrange(count):
+      fields = _RECORD.unpack_from(mapped, offset)
+      offset += _RECORD.size
+      path_len, flags, value_len, children_len = fields[:4]
+      path   = mapped[offset:offset+path_len]
+      offset += path_len
+      value  = mapped[offset:offset+value_len]
+      offset += value_len
+      names  = mapped[offset:offset+children_len]
+      offset += children_len
+
+      if flags & DELETED:
+        entries.append(Entry(path, deleted=True))
+        continue
+      entry = Entry(path)
+      if flags & HAS_VALUE:
+        entry.value = None if flags & NULL_VALUE else value
+        entry.stat  = dict(zip(STAT_FIELDS, fields[4:]))
+      if flags & HAS_CHILDREN:
+        entry.children = names.split('\0') if names else []
+      entries.append(entry)
+    return entries
+  finally:
+    mapped.close()
@@ -0,0 +1,106 @@
+from threading import Lock
+
+class Histogram(object):
+  """A latency histogram with one bucket per power of two microseconds. It
+  keeps no samples, so recording is cheap and its size is fixed.
+  """
+  BUCKETS = 32
+
+  def __init__(self):
+    self.__lock   = Lock()
+    self.__counts = [0] * self.BUCKETS
+    self.__count  = 0
+    self.__total  = 0.0
+    self.__max    = 0.0
+
+  def record(self, seconds):
+    bucket = min(int(seconds * 1e6).bit_length(), self.BUCKETS - 1)
+    with self.__lock:
+      self.__counts[bucket] += 1
+      self.__count          += 1
+      self.__total          += seconds
+      if seconds > self.__max:
+        self.__max = seconds
+
+  def snapshot(self):
+    """Return a dict with the count, mean and max of the recorded latencies,
+    and the 50th, 90th and 99th percentiles (as their buckets' upper bounds),
+    all in seconds.
+    """
+    with self.__lock:
+      counts = list(self.__counts)
+      count  = self.__count
+      total  = self.__total
+      most   = self.__max
+    result = {
+        'count': count,
+        'mean':  total / count if count else 0.0,
+        'max':   most,
+        }
+    for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+      result[name] = _percentile(counts, count, fraction, most)
+    return result
+
+def _percentile(counts, count, fraction, most):
+  if not count:
+    return 0.0
+  wanted = count * fraction
+  seen   = 0
+  for bucket, bucket_count in enumerate(counts):
+    seen += bucket_count
+    if seen >= wanted:
+      return min((1 << bucket) / 1e6, most)
+  return most
+
+class Stats(object):
+  """A set of named counters and latency histograms, created as they are
+  first used.
+  """
+  def __init__(self):
+    self.__lock       = Lock()
+    self.__counters   = {}
+    self.__histograms = {}
+
+  def incr(self, name, amount=1):
+    with self.__lock:
+      self.__counters[name] = self.__counters.get(name, 0) + amount
+
+  def record(self, name, seconds):
+    try:
+      histogram = self.__histograms[name]
+    except KeyError:
+      histogram = self.__histograms.setdefault(name, Histogram())
+    histogram.record(seconds)
+
+  def snapshot(self):
+    """Return a dict with a 'counters' dict of counter values and a
+    'latencies' dict of histogram snapshots.
+    """
+    with self.__lock:
+      counters = dict(self.__counters)
+    return {
+        'counters':  counters,
+        'latencies': dict((name, histogram.snapshot())
+          for name, histogram in self.__histograms.items()),
+        }
+
+def format_stats(stats, indent=0):
+  """Render a (nested) stats dict, like the one Mirror.stats returns, as
+  indented lines of text.
+  """
+  lines = []
+  for key in sorted(stats):
+    value = stats[key]
+    if isinstance(value, dict):
+      lines.append('%s%s:' % ('  ' * indent, key))
+      lines.extend(format_stats(value, indent + 1))
+    elif isinstance(value, list):
+      lines.append('%s%s:' % ('  ' * indent, key))
+      for idx, item in enumerate(value):
+        lines.append('%s[%d]' % ('  ' * (indent + 1), idx))
+        lines.extend(format_stats(item, indent + 2))
+    elif isinstance(value, float):
+      lines.append('%s%-12s %.6f' % ('  ' * indent, key, value))
+    else:
+      lines.append('%s%-12s %s' % ('  ' * indent, key, value))
+  return lines
@@ -77,6 +77,8 @@ import zookeeper
 
 import functools
 
+from .path import Path
+
 class ZooServerProblem(Exception):
   """All the zookeeper exceptions that indicate a problem with the actual
   ZooKeeper server (or our connection to it) are (coerced into becoming)
@@ -94,11 +96,59 @@ SessionExpiredException.__bases__    += (ZooServerProblem,)
 SessionMovedException.__bases__      += (ZooServerProblem,)
 SystemErrorException.__bases__       += (ZooServerProblem,)
 
+_EXCEPTIONS = {
+    APIERROR:                ApiErrorException,
+    AUTHFAILED:              AuthFailedException,
+    BADARGUMENTS:            BadArgumentsException,
+    BADVERSION:              BadVersionException,
+    CLOSING:                 ClosingException,
+    CONNECTIONLOSS:          ConnectionLossException,
+    DATAINCONSISTENCY:       DataInconsistencyException,
+    INVALIDACL:              InvalidACLException,
+    INVALIDCALLBACK:         InvalidCallbackException,
+    INVALIDSTATE:            InvalidStateException,
+    MARSHALLINGERROR:        MarshallingErrorException,
+    NOAUTH:                  NoAuthException,
+    NOCHILDRENFOREPHEMERALS: NoChildrenForEphemeralsException,
+    NONODE:                  NoNodeException,
+    NODEEXISTS:              NodeExistsException,
+    NOTEMPTY:                NotEmptyException,
+    NOTHING:                 NothingException,
+    OPERATIONTIMEOUT:        OperationTimeoutException,
+    RUNTIMEINCONSISTENCY:    RuntimeInconsistencyException,
+    SESSIONEXPIRED:          SessionExpiredException,
+    SESSIONMOVED:            SessionMovedException,
+    SYSTEMERROR:             SystemErrorException,
+    UNIMPLEMENTED:           UnimplementedException,
+    }
+
+def error_for(status):
+  """Build the exception that zookeeper's synchronous calls would have raised
+  for the given completion status.
+  """
+  cls = _EXCEPTIONS.get(status, ZooKeeperException)
+  return cls(zookeeper.zerror(status))
+
+def normalize(path):
+  """Makes paths pretty: a single leading slash, no trailing or repeated
+  slashes. The result is a Path, which later calls leave alone.
+  """
+  return Path(path)
+
+def ancestors(path):
+  """List the proper ancestors of a normalized path, shallowest first, not
+  including the root.
+  """
+  parts = path.split('/')[1:-1]
+  return ['/' + '/'.join(parts[:idx]) for idx in range(1, len(parts)+1)]
+
 def fix_path(fn):
   """Don't want to describe this. makes paths pretty.
   """
-  def wrapper(self, path, *args):
-    return fn(self, '/' + '/'.join(filter(None, path.split('/'))), *args)
+  def wrapper(self, path, *args, **kwargs):
+    if type(path) is not Path:
+      path = Path(path)
+    return fn(self, path, *args, **kwargs)
   functools.update_wrapper(wrapper, fn)
   return wrapper
 
@@ -128,6 +178,21 @@ def _populate_names(dct, ending):
 
 ALL_ACL = [{"perms":0x1f, "scheme":"world", "id" :"anyone"}]
 
+# The fields of a node's stat, in the order Meta and snapshots keep them
+STAT_FIELDS = (
+    'czxid',
+    'mzxid',
+    'ctime',
+    'mtime',
+    'version',
+    'cversion',
+    'aversion',
+    'ephemeralOwner',
+    'dataLength',
+    'numChildren',
+    'pzxid',
+    )
+
 __all__ = [
     ApiErrorException,
     AuthFailedException,
@@ -206,6 +271,10 @@ __all__ = [
     UNIMPLEMENTED,
     
     ZooServerProblem,
+    STAT_FIELDS,
+    error_for,
+    normalize,
+    ancestors,
     fix_path,
     silence,
     describe_state,